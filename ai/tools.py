@@ -1,5 +1,7 @@
 from rapidfuzz import fuzz
 import json
+import os
+import re
 from pathlib import Path
 from typing import Dict
 from ai.models.intent import IntentData
@@ -7,6 +9,59 @@ from crewai.tools import tool
 
 VALID_APT_PATH = Path("data/apartamentos.json")
 
+# Índice (apartamento, nome) normalizados -> (voip_number, nome original), carregado sob demanda
+# e guardado junto com o mtime do arquivo que o originou: (mtime_ns, índice)
+_indice_exato = None
+
+_SIP_RE = re.compile(r'^sip:(\d+)@')
+
+def extrair_numero_sip(voip_number) -> str:
+    """Extrai a parte numérica de um SIP URI (sip:XXX@dominio) e garante retorno em string."""
+    if isinstance(voip_number, str) and voip_number.startswith("sip:"):
+        sip_match = _SIP_RE.match(voip_number)
+        if sip_match:
+            return sip_match.group(1)
+    if not isinstance(voip_number, str):
+        voip_number = str(voip_number)
+    return voip_number
+
+
+def apartamentos_mtime():
+    """mtime (ns) de data/apartamentos.json, usado para invalidar caches derivados; None se não existir."""
+    try:
+        return os.stat(VALID_APT_PATH).st_mtime_ns
+    except OSError:
+        return None
+
+
+def indice_moradores_exato() -> Dict:
+    """
+    Retorna o índice para casamento exato de apartamento + morador,
+    permitindo evitar o cálculo fuzzy quando o visitante informa os dados corretos.
+    As chaves usam a mesma normalização da busca (strip + lower) e o índice é
+    refeito quando apartamentos.json muda. Os valores são (voip_number, nome do
+    morador, apartment_number original), como no resultado do fuzzy. Em caso de
+    erro de leitura retorna um índice vazio (sem cache) para nova tentativa.
+    """
+    global _indice_exato
+    mtime = apartamentos_mtime()
+    if _indice_exato is None or _indice_exato[0] != mtime:
+        try:
+            with open(VALID_APT_PATH, "r", encoding="utf-8") as f:
+                apartamentos = json.load(f)
+        except Exception as e:
+            print(f"Erro ao ler arquivo de apartamentos: {e}")
+            return {}
+
+        _indice_exato = (mtime, {
+            (str(apartamento["apartment_number"]).strip().lower(), residente.strip().lower()):
+                (extrair_numero_sip(apartamento.get("voip_number", "")), residente, apartamento["apartment_number"])
+            for apartamento in apartamentos
+            for residente in apartamento["residents"]
+        })
+    return _indice_exato[1]
+
+
 @tool("SendMessageTool")
 def identify_user_intent(message: str) -> str:
     """
@@ -131,18 +186,8 @@ def validar_intent_com_fuzzy(intent: Dict) -> Dict:
             logger.info(f"Match encontrado: {best_match} no apt {best_apt['apartment_number']} (score={best_score})")
             logger.info(f"voip_number original: {voip_number}")
             
-            # Verificar se o número está no formato SIP URI e processar adequadamente
-            if isinstance(voip_number, str) and voip_number.startswith("sip:"):
-                # Extrair apenas a parte numérica se estiver no formato sip:XXX@dominio
-                import re
-                sip_match = re.match(r'sip:(\d+)@', voip_number)
-                if sip_match:
-                    voip_number = sip_match.group(1)
-                    logger.info(f"Extraído número do SIP URI: {voip_number}")
-            
-            # Garantir que o número seja uma string válida
-            if not isinstance(voip_number, str):
-                voip_number = str(voip_number)
+            # Extrair apenas a parte numérica se estiver no formato sip:XXX@dominio
+            voip_number = extrair_numero_sip(voip_number)
             
             logger.info(f"voip_number processado: {voip_number}")
             print(f"Match encontrado: {best_match} no apt {best_apt['apartment_number']} (score={best_score}), voip={voip_number}")
@@ -4,6 +4,7 @@ import asyncio
 import json
 import logging
 import struct
+from collections import deque
 from enum import Enum
 import wave
 
@@ -26,6 +27,8 @@ SAMPLE_RATE = 8000
 CHANNELS = 1
 DEBUG_DIR = "audio/debug"
 TERMINATE_CHECK_INTERVAL = 1
+# Limite de frames mantidos para os WAVs de debug (~5 min em frames de 20 ms); chamadas longas guardam só o final
+DEBUG_AUDIO_MAX_FRAMES = 15000
 os.makedirs(DEBUG_DIR, exist_ok=True)
 
 class VoiceDetectionType(Enum):
@@ -69,6 +72,8 @@ try:
         TRANSMISSION_DELAY_MS = config['audio'].get('transmission_delay_ms', 20) / 1000  # Convertido para segundos
         POST_AUDIO_DELAY_SECONDS = config['audio'].get('post_audio_delay_seconds', 0.5)
         DISCARD_BUFFER_FRAMES = config['audio'].get('discard_buffer_frames', 25)
+        # Áudio acumulado por escrita no PushAudioInputStream (frames de 20 ms agrupados)
+        PUSH_STREAM_CHUNK_MS = config['audio'].get('push_stream_chunk_ms', 100)
         GOODBYE_DELAY_SECONDS = config['system'].get('goodbye_delay_seconds',
                                                      3.0)  # Tempo para ouvir mensagem de despedida
 
@@ -86,10 +91,31 @@ except Exception as e:
     TRANSMISSION_DELAY_MS = 0.02
     POST_AUDIO_DELAY_SECONDS = 0.5
     DISCARD_BUFFER_FRAMES = 25
+    PUSH_STREAM_CHUNK_MS = 100
     GOODBYE_DELAY_SECONDS = 3.0
     VOICE_DETECTION_TYPE = VoiceDetectionType.WEBRTCVAD
     AZURE_SPEECH_SEGMENT_TIMEOUT_MS = 800
 
+# Formato do áudio SLIN do AudioSocket (8 kHz, 16 bits, mono), criado uma única vez
+AUDIO_FORMAT_SLIN = speechsdk.audio.AudioStreamFormat(samples_per_second=SAMPLE_RATE, bits_per_sample=16, channels=CHANNELS)
+
+# SpeechConfig compartilhado por (chave, região): o SDK copia as propriedades para cada reconhecedor
+_speech_configs = {}
+
+def obter_speech_config():
+    """Retorna o SpeechConfig pt-BR das credenciais atuais, criando-o na primeira chamada."""
+    key = (os.getenv("AZURE_SPEECH_KEY"), os.getenv("AZURE_SPEECH_REGION"))
+    speech_config = _speech_configs.get(key)
+    if speech_config is None:
+        speech_config = speechsdk.SpeechConfig(subscription=key[0], region=key[1])
+        speech_config.speech_recognition_language = "pt-BR"
+        _speech_configs[key] = speech_config
+    return speech_config
+
+# Bytes de SLIN (16 bits) por escrita no push stream: menos escritas no SDK em troca de até
+# PUSH_STREAM_CHUNK_MS de atraso extra na detecção do fim da fala
+PUSH_STREAM_CHUNK_BYTES = SAMPLE_RATE * PUSH_STREAM_CHUNK_MS // 1000 * 2 * CHANNELS
+
 def set_extension_manager(manager):
     """
     Define o extension_manager global para ser usado pelo handler.
@@ -104,6 +130,21 @@ async def read_tlv_packet(reader):
     payload = await reader.readexactly(length)
     return packet_type, payload
 
+def preconectar_reconhecedor(recognizer, call_id):
+    """
+    Abre antecipadamente a conexão WebSocket do reconhecedor com o Azure Speech,
+    para que o handshake TLS/WS não atrase o primeiro reconhecimento.
+    Retorna o objeto Connection: quem chama mantém a referência enquanto o reconhecedor
+    viver e a fecha ao encerrar o reconhecimento.
+    """
+    try:
+        connection = speechsdk.Connection.from_recognizer(recognizer)
+        connection.open(True)  # True = reconhecimento contínuo
+        return connection
+    except Exception as e:
+        logger.warning(f"[{call_id}] Não foi possível pré-conectar o reconhecedor: {e}")
+        return None
+
 async def check_terminate_flag(session, call_id, role, call_logger=None):
     event = session.terminate_visitor_event if role == "visitante" else session.terminate_resident_event
 
@@ -238,14 +279,9 @@ async def iniciar_servidor_audiosocket_visitante(reader, writer):
         logger.info(f"[{call_id}] [TURNO] Estado inicial definido como IA_TURN para evitar captura durante boas-vindas")
 
     # Preparar configuração do Azure Speech, mas não iniciar ainda
-    speech_config = speechsdk.SpeechConfig(
-        subscription=os.getenv("AZURE_SPEECH_KEY"),
-        region=os.getenv("AZURE_SPEECH_REGION")
-    )
-    speech_config.speech_recognition_language = "pt-BR"
-
-    audio_format = speechsdk.audio.AudioStreamFormat(samples_per_second=SAMPLE_RATE, bits_per_sample=16, channels=CHANNELS)
-    push_stream = speechsdk.audio.PushAudioInputStream(audio_format)
+    speech_config = obter_speech_config()
+
+    push_stream = speechsdk.audio.PushAudioInputStream(AUDIO_FORMAT_SLIN)
     audio_config = speechsdk.audio.AudioConfig(stream=push_stream)
 
     recognizer = speechsdk.SpeechRecognizer(speech_config, audio_config)
@@ -253,6 +289,10 @@ async def iniciar_servidor_audiosocket_visitante(reader, writer):
     # Criar objeto SpeechCallbacks e configurar como visitante
     callbacks = SpeechCallbacks(call_id=call_id, session_manager=session_manager, is_visitor=True)
     callbacks.register_callbacks(recognizer)
+
+    # Pré-conectar durante as boas-vindas: o reconhecedor ainda não está ativo, mas o
+    # WebSocket já fica pronto quando start_continuous_recognition_async for chamado
+    speech_connection = preconectar_reconhecedor(recognizer, call_id)
     
     # Armazenar referência ao objeto callbacks na sessão
     if session:
@@ -261,7 +301,7 @@ async def iniciar_servidor_audiosocket_visitante(reader, writer):
     # IMPORTANTE: Não iniciar o reconhecimento ainda
     # Vamos primeiro enviar a mensagem de boas-vindas
     
-    audio_buffer = []
+    audio_buffer = deque(maxlen=DEBUG_AUDIO_MAX_FRAMES)
     
     # Enviar mensagem de boas-vindas diretamente (sem reconhecimento ativo)
     welcome_message = "Olá, seja bem-vindo! Por favor, informe o que deseja: se entrega ou visita."
@@ -308,6 +348,9 @@ async def iniciar_servidor_audiosocket_visitante(reader, writer):
 
     push_stream.close()
     recognizer.stop_continuous_recognition_async()
+    # A referência mantida até aqui é o que deixa a conexão pré-aberta viva durante a chamada
+    if speech_connection is not None:
+        speech_connection.close()
 
     audio_data = b''.join(audio_buffer)
     filename = os.path.join(DEBUG_DIR, f"audio_{call_id}.wav")
@@ -320,18 +363,24 @@ async def iniciar_servidor_audiosocket_visitante(reader, writer):
     logger.info(f"Áudio salvo em {filename}")
 
 async def receber_audio_visitante(reader, call_id, push_stream, callbacks, audio_buffer):
+    pending = bytearray()  # Frames ainda não repassados ao push stream
     try:
         while True:
             packet_type, payload = await read_tlv_packet(reader)
             if packet_type == 0x10:
                 audio_buffer.append(payload)
-                push_stream.write(payload)
+                pending += payload
+                if len(pending) >= PUSH_STREAM_CHUNK_BYTES:
+                    push_stream.write(bytes(pending))
+                    pending.clear()
                 callbacks.add_audio_chunk(payload)
             elif packet_type == 0x01:
                 logger.info(f"UUID recebido: {payload.hex()}")
             elif packet_type == 0x00:
                 logger.info("Pacote de término recebido.")
                 break
+        if pending:
+            push_stream.write(bytes(pending))
     except asyncio.IncompleteReadError:
         await encerrar_conexao(call_id, "morador")
         logger.warning("Conexão fechada abruptamente.")
@@ -434,21 +483,16 @@ import wave  # certifique-se que wave está importado no topo
 async def receber_audio_morador(reader: asyncio.StreamReader, call_id: str):
     call_logger = CallLoggerManager.get_logger(call_id)
 
-    azure_key = os.getenv('AZURE_SPEECH_KEY')
-    azure_region = os.getenv('AZURE_SPEECH_REGION')
-
-    speech_config = speechsdk.SpeechConfig(subscription=azure_key, region=azure_region)
-    speech_config.speech_recognition_language = 'pt-BR'
+    speech_config = obter_speech_config()
 
-    push_stream = speechsdk.audio.PushAudioInputStream(
-        stream_format=speechsdk.audio.AudioStreamFormat(samples_per_second=8000, bits_per_sample=16, channels=1)
-    )
+    push_stream = speechsdk.audio.PushAudioInputStream(stream_format=AUDIO_FORMAT_SLIN)
 
     audio_config = speechsdk.audio.AudioConfig(stream=push_stream)
     recognizer = speechsdk.SpeechRecognizer(speech_config=speech_config, audio_config=audio_config)
+    speech_connection = preconectar_reconhecedor(recognizer, call_id)
 
     # Buffer para salvar todo o áudio recebido do morador
-    raw_audio_buffer = []
+    raw_audio_buffer = deque(maxlen=DEBUG_AUDIO_MAX_FRAMES)
 
     async def process_recognized_text(text, audio_data):
         if not audio_data or len(audio_data) < 2000:
@@ -483,6 +527,7 @@ async def receber_audio_morador(reader: asyncio.StreamReader, call_id: str):
     recognizer.start_continuous_recognition_async()
     logger.info(f"[{call_id}] Reconhecimento de voz do morador iniciado")
 
+    pending = bytearray()  # Frames ainda não repassados ao push stream
     try:
         while True:
             packet_type, payload = await read_tlv_packet(reader)
@@ -491,9 +536,16 @@ async def receber_audio_morador(reader: asyncio.StreamReader, call_id: str):
                 session = session_manager.get_session(call_id)
                 if session and session.resident_state != "USER_TURN":
                     logger.debug(f"[{call_id}] Ignorando áudio: estado atual é {session.resident_state}")
+                    if pending:
+                        # Fim do turno do morador: entrega o que restou sem esperar completar o bloco
+                        push_stream.write(bytes(pending))
+                        pending.clear()
                     continue
 
-                push_stream.write(payload)
+                pending += payload
+                if len(pending) >= PUSH_STREAM_CHUNK_BYTES:
+                    push_stream.write(bytes(pending))
+                    pending.clear()
                 speech_callbacks.add_audio_chunk(payload)
 
                 # Salvar no buffer completo para depuração
@@ -511,6 +563,8 @@ async def receber_audio_morador(reader: asyncio.StreamReader, call_id: str):
         logger.info(f"[{call_id}] Morador desconectado.")
     finally:
         recognizer.stop_continuous_recognition_async()
+        if speech_connection is not None:
+            speech_connection.close()
 
         # Salvar o áudio bruto recebido em WAV
         filename = f"audio/debug/morador_raw_{call_id}_{int(time.time())}.wav"
@@ -604,10 +658,10 @@ async def encerrar_conexao(call_id: str, role: str):
             return
 
         conn = resource_manager.get_active_connection(call_id, role)
-        if not conn or 'writer' not in conn:
+        if conn is None or conn.writer is None:
             logger.warning(f"[{call_id}] Writer do {role} não encontrado ou já encerrado")
         else:
-            writer = conn['writer']
+            writer = conn.writer
             try:
                 logger.info(f"[{call_id}] Enviando byte de HANGUP (0x00) para {role}")
                 writer.write(struct.pack('>B H', 0x00, 0))
@@ -2,20 +2,50 @@
 
 import logging
 import time
+from collections import OrderedDict
 from enum import Enum, auto
+from functools import lru_cache
 from typing import Optional
 
 from ai.crew import process_user_message_with_coordinator
-from ai.tools import validar_intent_com_fuzzy
+from ai.tools import validar_intent_com_fuzzy, indice_moradores_exato, extrair_numero_sip, apartamentos_mtime
+from services import amqp_pool
 
 import pika
 import json
+try:
+    import orjson
+except ImportError:
+    orjson = None
 import asyncio
-import socket
+import concurrent.futures
 import re
+import struct
+import threading
+import unicodedata
+
+__all__ = ["ConversationFlow", "FlowState", "FINAL_MESSAGES"]
 
 logger = logging.getLogger(__name__)
 
+def _start_call_loop() -> asyncio.AbstractEventLoop:
+    """Cria o loop de eventos persistente que executa os processos de chamada."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="flow-call-loop", daemon=True).start()
+    return loop
+
+# Loop único e de longa duração para iniciar_processo_chamada (evita thread + asyncio.run por chamada)
+_CALL_LOOP = _start_call_loop()
+
+# Pool limitado para o trabalho bloqueante residual (ex.: hangup), em vez de uma thread nova por chamada
+_CALL_EXEC = concurrent.futures.ThreadPoolExecutor(max_workers=32, thread_name_prefix='flow-call')
+
+# Frame KIND_HANGUP do AudioSocket (tipo 0x00, payload vazio), empacotado uma única vez
+KIND_HANGUP_FRAME = struct.pack('>B H', 0x00, 0)
+
+# Tempo máximo aguardando as tarefas de audiosocket concluírem a terminação após o hangup
+_TERMINATION_WAIT_TIMEOUT = 2.0
+
 class FlowState(Enum):
     COLETANDO_DADOS = auto()
     VALIDADO = auto()
@@ -24,13 +54,170 @@ class FlowState(Enum):
     ESPERANDO_MORADOR = auto()
     FINALIZADO = auto()
 
+# Estados em que o morador já foi envolvido (ambos recebem mensagem na finalização)
+_RESIDENT_INVOLVED_STATES = frozenset({
+    FlowState.CHAMANDO_MORADOR, FlowState.CALLING_IN_PROGRESS,
+    FlowState.ESPERANDO_MORADOR, FlowState.FINALIZADO,
+})
+
+# Termos de pergunta (A), aprovação (Y) e negação (N) do morador, casados como palavras inteiras.
+# O texto chega normalizado por _normalize_text (sem acentos), por isso "não" aparece como "nao".
+_ASK_WORDS = ("quem",)
+_YES_WORDS = ("sim", "s", "autorizo", "pode entrar", "autorizado", "deixa entrar", "libera", "ok", "claro", "positivo")
+_NO_WORDS = ("nao", "nego", "negativa", "negativo", "negado", "bloqueado", "barrado", "recusado", "nunca")
+
+# Um único autômato com grupos nomeados classifica todas as classes numa só varredura
+_ANSWER_RE = re.compile(
+    r'(?P<A>\b(?:%s)\b|\?)|(?P<Y>\b(?:%s)\b)|(?P<N>\b(?:%s)\b)' % tuple(
+        "|".join(map(re.escape, words)) for words in (_ASK_WORDS, _YES_WORDS, _NO_WORDS)
+    ),
+    re.IGNORECASE
+)
+
+# Caminho rápido: respostas curtas exatamente como o ASR costuma transcrevê-las ("Sim.", "Não!"),
+# resolvidas por uma consulta de dicionário sem normalizar o texto nem rodar a regex
+_EXACT_ANSWERS = {
+    variant + punct: answer
+    for word, answer in (("sim", "Y"), ("não", "N"), ("nao", "N"), ("quem?", "A"), ("quem", "A"))
+    for variant in (word, word.capitalize(), word.upper())
+    for punct in ("", ".", "!")
+}
+
+# Descrições por tipo de intent e modelos das mensagens da decisão do morador
+_INTENT_DESC = {"entrega": "uma entrega", "visita": "uma visita", "servico": "um serviço"}
+_INTENT_MSG = {"entrega": "entrega", "visita": "visita"}
+_RESIDENT_REQUEST_TMPL = "{v} está na portaria solicitando {d}. Você autoriza a entrada? Responda SIM ou NÃO."
+_RESIDENT_AUTHORIZED_TMPL = "Obrigado! {v} será informado que a {m} foi autorizada."
+_VISITOR_AUTHORIZED_TMPL = "Ótima notícia! O morador autorizou sua {m}."
+_RESIDENT_DENIED_TMPL = "Entendido. {v} será informado que a {m} não foi autorizada."
+_VISITOR_DENIED_TMPL = "Infelizmente o morador não autorizou sua {m} neste momento."
+
+# Mensagens de finalização por (authorization_result, intent_type); intent None vale para qualquer tipo
+_VISITOR_FINAL_DEFAULT = "A chamada com o morador foi finalizada. Obrigado por utilizar nosso sistema."
+_VISITOR_FINAL_MSG = {
+    ("authorized", "entrega"): "Sua entrega foi autorizada pelo morador. Finalizando a chamada.",
+    ("authorized", "visita"): "Sua visita foi autorizada pelo morador. Finalizando a chamada.",
+    ("authorized", None): "Sua entrada foi autorizada pelo morador. Finalizando a chamada.",
+    ("denied", None): "Sua entrada não foi autorizada pelo morador. Finalizando a chamada.",
+}
+_RESIDENT_FINAL_MSG = "A conversa foi finalizada. Obrigado pela sua resposta."
+_VISITOR_ONLY_FINAL_MSG = "Conversa finalizada. Obrigado por utilizar nosso sistema."
+# Todas as mensagens fixas de finalização, sem repetição (pré-síntese em speech_service)
+FINAL_MESSAGES = tuple(dict.fromkeys((
+    _RESIDENT_FINAL_MSG, *_VISITOR_FINAL_MSG.values(), _VISITOR_FINAL_DEFAULT, _VISITOR_ONLY_FINAL_MSG
+)))
+
+# Intervalo entre tentativas após falha conhecida de envio (nack/erro do broker)
+_RETRY_BACKOFF = 0.1
+
+# Cache dos últimos resultados do coordenador por (session_id, texto), para absorver
+# transcrições parciais repetidas pelo ASR sem nova chamada ao LLM
+_COORD_CACHE_SIZE = 32
+_COORD_CACHE_TTL = 2.0
+_coord_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+_coord_cache_lock = threading.Lock()
+
+# Fragmentos triviais (ex.: "é", "ah") não são enviados ao coordenador;
+# o pedido de repetição é limitado a um a cada _REPEAT_PROMPT_INTERVAL segundos
+_REPEAT_PROMPT_INTERVAL = 2.0
+
+# Esqueleto fixo do payload de clicktocall; apenas guid, origin e timestamp variam.
+# Usado só quando os campos variáveis passam em _SAFE_FIELD_RE (dispensam escape JSON).
+_PAYLOAD_TMPL = (
+    b'{"data":{"destiny":"IA","guid":"%s","license":"123456789012","origin":"%s"},'
+    b'"operation":{"eventcode":"8001","guid":"cmd-%s","msg":"","timestamp":%d,"type":"clicktocall"}}'
+)
+_SAFE_FIELD_RE = re.compile(r'^[A-Za-z0-9_-]+$')
+
+
+def _normalize_text(text: str) -> str:
+    """Remove acentos, aplica casefold e strip uma única vez por mensagem ("NÃO!" -> "nao!")."""
+    return unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode().casefold().strip()
+
+@lru_cache(maxsize=128)
+def _classify_answer(norm: str) -> Optional[str]:
+    """
+    Classifica a resposta do morador (já normalizada por _normalize_text) como
+    pergunta ("A"), autorização ("Y"), negação ("N") ou não reconhecida (None).
+    A prioridade é A > Y > N quando mais de uma classe aparece.
+
+    O resultado fica em cache porque o ASR costuma reenviar a mesma transcrição.
+    """
+    found = set()
+    for match in _ANSWER_RE.finditer(norm):
+        if match.lastgroup == "A":
+            return "A"
+        found.add(match.lastgroup)
+    if "Y" in found:
+        return "Y"
+    if "N" in found:
+        return "N"
+    return None
+
+def _norm(s) -> str:
+    """Canonicaliza um campo da intent para uso como chave de cache."""
+    return (s or "").strip().lower()
+
+@lru_cache(maxsize=1024)
+def _fuzzy_cached(apt_key: str, name_key: str, data_mtime) -> dict:
+    """
+    Memoiza validar_intent_com_fuzzy por (apartamento, morador) normalizados,
+    já que o visitante costuma repetir os mesmos dados a cada turno.
+    data_mtime (apartamentos_mtime()) entra na chave: após alterar apartamentos.json
+    as entradas antigas deixam de ser usadas.
+    O dicionário retornado é compartilhado entre chamadas e não deve ser alterado.
+    """
+    return validar_intent_com_fuzzy({"apartment_number": apt_key, "resident_name": name_key})
+
+def _process_with_coordinator_cached(session_id: str, text: str) -> dict:
+    """
+    Chama process_user_message_with_coordinator, reaproveitando o resultado
+    quando a mesma transcrição da mesma sessão chega de novo em até _COORD_CACHE_TTL.
+    """
+    key = (session_id, text)
+    now = time.monotonic()
+    with _coord_cache_lock:
+        cached = _coord_cache.get(key)
+        if cached is not None and now - cached[0] <= _COORD_CACHE_TTL:
+            _coord_cache.move_to_end(key)
+            logger.debug("[Flow] Reutilizando resultado da IA para transcrição repetida: %r", text)
+            return cached[1]
+
+    result = process_user_message_with_coordinator(session_id, text)
+
+    if result is not None:
+        with _coord_cache_lock:
+            _coord_cache[key] = (time.monotonic(), result)
+            _coord_cache.move_to_end(key)
+            while len(_coord_cache) > _COORD_CACHE_SIZE:
+                _coord_cache.popitem(last=False)
+    return result
+
+def _log_call_result(future):
+    """Registra erros do processo de chamada executado no _CALL_LOOP."""
+    if future.cancelled():
+        logger.info("[Flow] Processo de chamada cancelado")
+        return
+    exc = future.exception()
+    if exc:
+        logger.error("[Flow] Erro no processo de chamada: %s", exc, exc_info=exc)
+
 class ConversationFlow:
     """
     Define o fluxo de interação entre visitante e morador, passo a passo.
     """
 
+    # Uma instância por sessão ativa: atributos fixos, sem __dict__ por objeto
+    __slots__ = (
+        'state', '_state_lock', 'intent_data', 'is_fuzzy_valid', 'voip_number_morador',
+        'extension_manager', 'tentativas_chamada', 'max_tentativas', 'call_timeout_seconds',
+        'calling_task', 'hangup_task', '_answered_event', '_ext_info', '_last_repeat_prompt',
+        '_loop',
+    )
+
     def __init__(self, extension_manager=None):
         self.state = FlowState.COLETANDO_DADOS
+        self._state_lock = threading.Lock()  # Serializa transições feitas por threads diferentes
         self.intent_data = {}
         self.is_fuzzy_valid = False
         self.voip_number_morador: Optional[str] = None
@@ -41,22 +228,59 @@ class ConversationFlow:
         self.max_tentativas = 2
         self.call_timeout_seconds = 10  # Tempo para aguardar antes de tentar novamente
         self.calling_task = None  # Referência para a tarefa assíncrona de chamada
+        self.hangup_task = None  # Task (ou Future, no fallback) do hangup ativo agendado
+
+        # Loop do audiosocket que criou a sessão: dono dos StreamWriters usados no KIND_HANGUP
+        try:
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._loop = None
+        self._answered_event = asyncio.Event()  # Sinalizado (no _CALL_LOOP) quando o morador atende
+        self._ext_info = None  # Configuração de ramal da sessão, consultada uma única vez
+        self._last_repeat_prompt = 0.0  # Último pedido de repetição por fragmento trivial
+
+    def _transition(self, new_state: FlowState, *expected: FlowState) -> bool:
+        """
+        Muda o estado de forma atômica.
+
+        Args:
+            new_state: Estado de destino
+            *expected: Estados de origem aceitos; se vazio, a transição é incondicional
+
+        Returns:
+            bool: True se a transição ocorreu, False se o estado atual não era o esperado
+        """
+        with self._state_lock:
+            if expected and self.state not in expected:
+                return False
+            self.state = new_state
+            return True
 
     # ---------------
     # VISITOR
     # ---------------
     def on_visitor_message(self, session_id: str, text: str, session_manager):
-        logger.debug(f"[Flow] Visitor message in state={self.state}, text='{text}'")
+        logger.debug("[Flow] Visitor message in state=%s, text=%r", self.state, text)
 
         if self.state == FlowState.COLETANDO_DADOS:
+            # Fragmentos sem nenhuma letra/dígito (vazio, pontuação) não justificam uma chamada
+            # ao LLM; respostas curtas válidas ("Zé", "1A") seguem para o coordenador
+            if not any(ch.isalnum() for ch in text):
+                logger.debug("[Flow] Ignorando fragmento trivial do visitante: %r", text)
+                now = time.monotonic()
+                if now - self._last_repeat_prompt >= _REPEAT_PROMPT_INTERVAL:
+                    self._last_repeat_prompt = now
+                    session_manager.enfileirar_visitor(session_id, "Pode repetir, por favor?")
+                return
+
             try:
                 # Adicionar timeout para prevenção de bloqueio
-                result = process_user_message_with_coordinator(session_id, text)
-                logger.debug(f"[Flow] result IA: {result}")
+                result = _process_with_coordinator_cached(session_id, text)
+                logger.debug("[Flow] result IA: %s", result)
                 
                 # Verificar se o resultado é None ou está vazio
                 if result is None:
-                    logger.error(f"[Flow] IA retornou resultado None para '{text}'")
+                    logger.error("[Flow] IA retornou resultado None para '%s'", text)
                     session_manager.enfileirar_visitor(
                         session_id,
                         "Desculpe, tive um problema ao processar sua mensagem. Por favor, repita ou informe novamente seus dados."
@@ -65,7 +289,7 @@ class ConversationFlow:
                 
                 # Se a chamada ao morador está em progresso, não processamos novas entradas do visitante
                 if self.state in [FlowState.CALLING_IN_PROGRESS, FlowState.ESPERANDO_MORADOR]:
-                    logger.info(f"[Flow] Ignorando entrada do visitante durante estado {self.state}")
+                    logger.info("[Flow] Ignorando entrada do visitante durante estado %s", self.state)
                     return
                 
                 # Atualiza self.intent_data com quaisquer dados retornados
@@ -73,10 +297,11 @@ class ConversationFlow:
                     for k, v in result["dados"].items():
                         self.intent_data[k] = v
                 else:
-                    logger.warning(f"[Flow] Resultado sem campo 'dados': {result}")
+                    logger.warning("[Flow] Resultado sem campo 'dados': %r", result)
                     
                 # Log de segurança para entender o estado atual
-                logger.info(f"[Flow] Dados acumulados: {self.intent_data}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("[Flow] Dados acumulados: %r", self.intent_data)
 
                 # Se veio alguma mensagem para o visitante, enfileira
                 if "mensagem" in result:
@@ -95,10 +320,11 @@ class ConversationFlow:
                     resident = self.intent_data.get("resident_name", "").strip()
                     
                     # Log detalhado para cada etapa
-                    logger.info(f"[Flow] Preparando para validação fuzzy com: apt={apt}, resident={resident}, data={self.intent_data}")
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("[Flow] Preparando para validação fuzzy com: apt=%s, resident=%s, data=%r", apt, resident, self.intent_data)
                     
                     if not apt or not resident:
-                        logger.warning(f"[Flow] Dados incompletos antes do fuzzy: apt={apt}, resident={resident}")
+                        logger.warning("[Flow] Dados incompletos antes do fuzzy: apt=%s, resident=%s", apt, resident)
                         session_manager.enfileirar_visitor(
                             session_id,
                             "Preciso do número do apartamento e nome do morador para continuar."
@@ -106,29 +332,35 @@ class ConversationFlow:
                         return
                     
                     # Verificação extra para depuração
-                    logger.info(f"[Flow] Iniciando validação fuzzy com intent_data: {self.intent_data}")
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("[Flow] Iniciando validação fuzzy com intent_data: %r", self.intent_data)
                     
                     # Executa a validação fuzzy
-                    fuzzy_res = validar_intent_com_fuzzy(self.intent_data)
-                    logger.info(f"[Flow] Resultado do fuzzy: {fuzzy_res}")
+                    # Caminho rápido: apartamento + nome exatos dispensam o cálculo fuzzy
+                    hit = indice_moradores_exato().get((_norm(apt), _norm(resident)))
+                    if hit:
+                        voip_number, match_name, apartment_number = hit
+                        fuzzy_res = {
+                            "status": "válido",
+                            "match_name": match_name,
+                            "voip_number": voip_number,
+                            "match_score": 100,
+                            "apartment_number": apartment_number
+                        }
+                    else:
+                        fuzzy_res = _fuzzy_cached(_norm(apt), _norm(resident), apartamentos_mtime())
+                        if fuzzy_res["status"] == "erro":
+                            # Falha transitória (ex.: leitura do arquivo): não manter em cache
+                            _fuzzy_cached.cache_clear()
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("[Flow] Resultado do fuzzy: %r", fuzzy_res)
 
                     if fuzzy_res["status"] == "válido":
                         self.is_fuzzy_valid = True
                         self.voip_number_morador = fuzzy_res.get("voip_number")
                         
-                        # Processar o voip_number para garantir um formato correto
-                        if isinstance(self.voip_number_morador, str) and self.voip_number_morador.startswith("sip:"):
-                            # Extrair apenas a parte numérica se estiver no formato sip:XXX@dominio
-                            sip_match = re.match(r'sip:(\d+)@', self.voip_number_morador)
-                            if sip_match:
-                                original_number = self.voip_number_morador
-                                self.voip_number_morador = sip_match.group(1)
-                                logger.info(f"[Flow] Convertido número SIP URI '{original_number}' para '{self.voip_number_morador}'")
-                        
-                        # Garantir que o voip_number é uma string
-                        if not isinstance(self.voip_number_morador, str):
-                            self.voip_number_morador = str(self.voip_number_morador)
-                            logger.info(f"[Flow] Convertido voip_number para string: {self.voip_number_morador}")
+                        # Mesmo normalizador do índice/fuzzy: parte numérica de sip:XXX@dominio, sempre string
+                        self.voip_number_morador = extrair_numero_sip(self.voip_number_morador)
                         
                         # Atualizar o intent_data com o nome correto do apartamento/morador
                         if "apartment_number" in fuzzy_res:
@@ -136,7 +368,10 @@ class ConversationFlow:
                         if "match_name" in fuzzy_res:
                             self.intent_data["resident_name"] = fuzzy_res["match_name"]
                             
-                        self.state = FlowState.VALIDADO
+                        # Avança para CHAMANDO_MORADOR; se outra mensagem já iniciou a chamada, não repete
+                        if not self._transition(FlowState.CHAMANDO_MORADOR, FlowState.COLETANDO_DADOS):
+                            logger.info("[Flow] Processo de chamada já iniciado para session_id=%s", session_id)
+                            return
 
                         # Mensagem única ao visitante (sem informar detalhes das tentativas)
                         session_manager.enfileirar_visitor(
@@ -144,33 +379,15 @@ class ConversationFlow:
                             "Aguarde enquanto entramos em contato com o morador..."
                         )
 
-                        # Avança para CHAMANDO_MORADOR e inicia o processo de chamada
-                        self.state = FlowState.CHAMANDO_MORADOR
-                        
-                        # Usar uma estratégia diferente: executar a coroutine em uma thread separada
-                        import threading
-                        
-                        def run_async_call():
-                            """Função auxiliar para executar a coroutine em uma thread separada"""
-                            try:
-                                logger.info(f"[Flow] Iniciando thread para executar iniciar_processo_chamada")
-                                # asyncio.run() vai criar um novo event loop e executar a coroutine nele
-                                asyncio.run(self.iniciar_processo_chamada(session_id, session_manager))
-                                logger.info(f"[Flow] Thread de chamada concluída com sucesso")
-                            except Exception as e:
-                                logger.error(f"[Flow] Erro em thread de chamada: {e}", exc_info=True)
+                        # Inicia o processo de chamada
                         
-                        # Iniciar a thread
-                        logger.info(f"[Flow] Criando thread para iniciar_processo_chamada com session_id={session_id}")
-                        call_thread = threading.Thread(target=run_async_call)
-                        call_thread.daemon = True  # Thread em segundo plano
-                        call_thread.start()
-                        
-                        # Armazenar referência
-                        self.calling_task = call_thread
-                        
-                        # Log para confirmar
-                        logger.info(f"[Flow] Thread para iniciar_processo_chamada iniciada")
+                        # Agendar a coroutine no loop persistente de chamadas
+                        self.calling_task = asyncio.run_coroutine_threadsafe(
+                            self.iniciar_processo_chamada(session_id, session_manager),
+                            _CALL_LOOP
+                        )
+                        self.calling_task.add_done_callback(_log_call_result)
+                        logger.debug("[Flow] Processo de chamada agendado para session_id=%s", session_id)
                     else:
                         # Mensagem com mais detalhes sobre o motivo da falha
                         if "best_match" in fuzzy_res and fuzzy_res.get("best_score", 0) > 50:
@@ -185,7 +402,7 @@ class ConversationFlow:
                             )
             except Exception as e:
                 # Tratamento de erro global para evitar travar o fluxo
-                logger.error(f"[Flow] Erro no processamento: {str(e)}")
+                logger.error("[Flow] Erro no processamento: %s", e)
                 session_manager.enfileirar_visitor(
                     session_id,
                     "Desculpe, ocorreu um erro ao processar sua solicitação. Por favor, tente novamente."
@@ -194,7 +411,7 @@ class ConversationFlow:
         elif self.state == FlowState.CHAMANDO_MORADOR or self.state == FlowState.CALLING_IN_PROGRESS:
             # Não atualizamos o visitante durante o processo de chamada
             # apenas log para debug
-            logger.debug(f"[Flow] Visitante tentou interagir durante processo de chamada em state={self.state}")
+            logger.debug("[Flow] Visitante tentou interagir durante processo de chamada em state=%s", self.state)
 
         elif self.state == FlowState.ESPERANDO_MORADOR:
             session_manager.enfileirar_visitor(
@@ -210,21 +427,23 @@ class ConversationFlow:
     # RESIDENT
     # ---------------
     def on_resident_message(self, session_id: str, text: str, session_manager):
-        logger.debug(f"[Flow] Resident message in state={self.state}, text='{text}'")
+        logger.debug("[Flow] Resident message in state=%s, text=%r", self.state, text)
 
         # Detectar conexão de áudio do morador (trigger especial do socket)
         is_connection_trigger = text == "AUDIO_CONNECTION_ESTABLISHED"
         
-        if (self.state == FlowState.CHAMANDO_MORADOR or self.state == FlowState.CALLING_IN_PROGRESS) and (is_connection_trigger or text):
+        if (is_connection_trigger or text) and self._transition(
+            FlowState.ESPERANDO_MORADOR, FlowState.CHAMANDO_MORADOR, FlowState.CALLING_IN_PROGRESS
+        ):
             # Mensagem especial para log quando é o gatilho de conexão
             if is_connection_trigger:
-                logger.info(f"[Flow] Detectada conexão de áudio do morador para session_id={session_id}")
+                logger.info("[Flow] Detectada conexão de áudio do morador para session_id=%s", session_id)
             else:
-                logger.info(f"[Flow] Morador atendeu e começou a falar: '{text}'")
+                logger.info("[Flow] Morador atendeu e começou a falar: '%s'", text)
                 
-            # Em qualquer caso, mudar para o estado de espera de resposta
-            self.state = FlowState.ESPERANDO_MORADOR
-            logger.info(f"[Flow] Morador atendeu chamada para sessão {session_id}. Mudando para estado ESPERANDO_MORADOR")
+            # Em qualquer caso, o estado já passou para espera de resposta
+            _CALL_LOOP.call_soon_threadsafe(self._answered_event.set)
+            logger.info("[Flow] Morador atendeu chamada para sessão %s. Mudando para estado ESPERANDO_MORADOR", session_id)
             
             # Verificar se temos os dados necessários para continuar
             visitor_name = self.intent_data.get("interlocutor_name", "")
@@ -232,17 +451,13 @@ class ConversationFlow:
             apt = self.intent_data.get("apartment_number", "")
             
             if not visitor_name or not intent_type or not apt:
-                logger.warning(f"[Flow] Dados incompletos ao atender morador: visitor={visitor_name}, intent={intent_type}, apt={apt}")
+                logger.warning("[Flow] Dados incompletos ao atender morador: visitor=%s, intent=%s, apt=%s", visitor_name, intent_type, apt)
                 visitor_name = visitor_name or "Um visitante"
                 intent_type = intent_type or "acesso"
                 apt = apt or "[não identificado]"
             
             # Mensagem detalhada para o morador com o contexto da visita
-            intent_desc = {
-                "entrega": "uma entrega",
-                "visita": "uma visita",
-                "servico": "um serviço",
-            }.get(intent_type, "um acesso")
+            intent_desc = _INTENT_DESC.get(intent_type, "um acesso")
             
             # Mensagem de saudação com pausa para evitar que a chamada caia imediatamente
             initial_greeting = f"Olá, morador do apartamento {apt}. Um momento por favor..."
@@ -252,8 +467,7 @@ class ConversationFlow:
             # Isso será processado assincronamente por enviar_mensagens_morador
             
             # Mensagem principal com os detalhes da visita
-            resident_msg = (f"{visitor_name} está na portaria solicitando {intent_desc}. "
-                           f"Você autoriza a entrada? Responda SIM ou NÃO.")
+            resident_msg = _RESIDENT_REQUEST_TMPL.format(v=visitor_name, d=intent_desc)
             session_manager.enfileirar_resident(session_id, resident_msg)
             
             # Notificar o visitante que o morador atendeu
@@ -261,16 +475,16 @@ class ConversationFlow:
 
         elif self.state == FlowState.ESPERANDO_MORADOR:
             # Processamento da resposta do morador
-            lower_text = text.lower()
             visitor_name = self.intent_data.get("interlocutor_name", "Visitante")
+            intent_type = self.intent_data.get("intent_type", "")
             
+            answer = _EXACT_ANSWERS.get(text)
+            if answer is None:
+                answer = _classify_answer(_normalize_text(text))
+
             # Verificar se contém pergunta antes de checar sim/não
-            if "quem" in lower_text or "?" in lower_text:
-                # Morador está pedindo mais informações
-                intent_type = self.intent_data.get("intent_type", "")
-                apt = self.intent_data.get("apartment_number", "")
-                
-                # Mensagem detalhada sobre o visitante
+            if answer == "A":
+                # Morador está pedindo mais informações: mensagem detalhada sobre o visitante
                 additional_info = f"{visitor_name} está na portaria para {intent_type}. "
                 if intent_type == "entrega":
                     additional_info += "É uma entrega para seu apartamento."
@@ -283,140 +497,9 @@ class ConversationFlow:
                     f"{additional_info} Por favor, responda SIM para autorizar ou NÃO para negar."
                 )
                 
-            # Lista mais precisa e controlada de termos de aprovação - removida a opção de string vazia
-            elif any(word in lower_text for word in ["sim", "autorizo", "pode entrar", "autorizado", "deixa entrar", "libera", "ok", "claro", "positivo"]) or text.strip().lower() == "sim" or text.strip().lower() == "s":
-                # Morador autorizou
-                logger.info(f"[Flow] Morador AUTORIZOU a entrada com resposta: '{text}'")
-                
-                # Intent type para mensagem personalizada
-                intent_type = self.intent_data.get("intent_type", "")
-                intent_msg = ""
-                if intent_type == "entrega":
-                    intent_msg = "entrega"
-                elif intent_type == "visita":
-                    intent_msg = "visita"
-                else:
-                    intent_msg = "entrada"
-                
-                # Mensagens personalizadas para o tipo de intent
-                session_manager.enfileirar_resident(
-                    session_id, 
-                    f"Obrigado! {visitor_name} será informado que a {intent_msg} foi autorizada."
-                )
-                session_manager.enfileirar_visitor(
-                    session_id, 
-                    f"Ótima notícia! O morador autorizou sua {intent_msg}."
-                )
-                
-                # Salvar resultado da autorização na sessão
-                self.intent_data["authorization_result"] = "authorized"
-                
-                # Registrar log especial para sinalizar finalização
-                logger.info(f"[Flow] Autorização CONCLUÍDA - alterando estado para FINALIZADO")
-                
-                # Atualizar o state e iniciar encerramento de forma controlada
-                self.state = FlowState.FINALIZADO
-                
-                # Código para enviar mensagem AMQP para o sistema físico de autorização
-                # Desabilitado temporariamente para uso futuro
-                """
-                from services.amqp_service import enviar_msg_autorizacao_morador
-                
-                # Criação do payload adequado
-                payload = {
-                    "call_id": session_id,
-                    "action": "authorize",
-                    "apartment": self.intent_data.get("apartment_number", ""),
-                    "resident": self.intent_data.get("resident_name", ""),
-                    "visitor": self.intent_data.get("interlocutor_name", ""),
-                    "intent_type": self.intent_data.get("intent_type", "entrada"),
-                    "authorization_result": "authorized"
-                }
-                
-                # Envia assíncronamente para não bloquear o fluxo
-                logger.info(f"[Flow] Enviando notificação de AUTORIZAÇÃO para sistema físico: {payload}")
-                try:
-                    success = enviar_msg_autorizacao_morador(payload)
-                    if success:
-                        logger.info(f"[Flow] Notificação enviada com sucesso para sistema físico")
-                    else:
-                        logger.error(f"[Flow] Falha ao enviar notificação para sistema físico")
-                except Exception as e:
-                    logger.error(f"[Flow] Erro ao notificar sistema físico: {str(e)}")
-                """
-                
-                # Log para desenvolvimento
-                logger.info(f"[Flow] Módulo AMQP para notificação de portaria desabilitado - uso futuro")
-                
-                # Finalmente, iniciar processo de finalização controlada
-                self._finalizar(session_id, session_manager)
-                
-            # Lista expandida de termos de negação    
-            elif any(word in lower_text for word in ["não", "nao", "nego", "negativa", "negado", "bloqueado", "barrado", "recusado", "nunca"]):
-                # Morador negou
-                logger.info(f"[Flow] Morador NEGOU a entrada com resposta: '{text}'")
-                
-                # Intent type para mensagem personalizada
-                intent_type = self.intent_data.get("intent_type", "")
-                intent_msg = ""
-                if intent_type == "entrega":
-                    intent_msg = "entrega"
-                elif intent_type == "visita":
-                    intent_msg = "visita"
-                else:
-                    intent_msg = "entrada"
-                
-                session_manager.enfileirar_resident(
-                    session_id, 
-                    f"Entendido. {visitor_name} será informado que a {intent_msg} não foi autorizada."
-                )
-                session_manager.enfileirar_visitor(
-                    session_id, 
-                    f"Infelizmente o morador não autorizou sua {intent_msg} neste momento."
-                )
-                
-                # Salvar resultado da autorização na sessão
-                self.intent_data["authorization_result"] = "denied"
-                
-                # Registrar log especial para sinalizar finalização
-                logger.info(f"[Flow] Negação CONCLUÍDA - alterando estado para FINALIZADO")
-                
-                # Atualizar o state e iniciar encerramento de forma controlada
-                self.state = FlowState.FINALIZADO
-                
-                # Código para enviar mensagem AMQP para o sistema físico de negação
-                # Desabilitado temporariamente para uso futuro
-                """
-                from services.amqp_service import enviar_msg_autorizacao_morador
-                
-                # Criação do payload adequado
-                payload = {
-                    "call_id": session_id,
-                    "action": "deny",
-                    "apartment": self.intent_data.get("apartment_number", ""),
-                    "resident": self.intent_data.get("resident_name", ""),
-                    "visitor": self.intent_data.get("interlocutor_name", ""),
-                    "intent_type": self.intent_data.get("intent_type", "entrada"),
-                    "authorization_result": "denied"
-                }
-                
-                # Envia assíncronamente para não bloquear o fluxo
-                logger.info(f"[Flow] Enviando notificação de NEGAÇÃO para sistema físico: {payload}")
-                try:
-                    success = enviar_msg_autorizacao_morador(payload)
-                    if success:
-                        logger.info(f"[Flow] Notificação enviada com sucesso para sistema físico")
-                    else:
-                        logger.error(f"[Flow] Falha ao enviar notificação para sistema físico")
-                except Exception as e:
-                    logger.error(f"[Flow] Erro ao notificar sistema físico: {str(e)}")
-                """
-                
-                # Log para desenvolvimento
-                logger.info(f"[Flow] Módulo AMQP para notificação de portaria desabilitado - uso futuro")
-                
-                # Finalmente, iniciar processo de finalização controlada
-                self._finalizar(session_id, session_manager)
+            elif answer is not None:
+                # Morador autorizou (True) ou negou (False)
+                self._handle_decision(session_id, session_manager, visitor_name, intent_type, text, authorized=(answer == "Y"))
                 
             else:
                 # Resposta não reconhecida
@@ -437,6 +520,39 @@ class ConversationFlow:
         else:
             # Estado VALIDADO ou outro
             session_manager.enfileirar_resident(session_id, "Ainda estou preparando a chamada, aguarde.")
+    def _handle_decision(self, session_id: str, session_manager, visitor_name: str,
+                         intent_type: str, text: str, authorized: bool):
+        """
+        Aplica a decisão do morador (autorização ou negação): informa ambas as partes,
+        registra o resultado na intent e inicia o encerramento controlado.
+        Apenas a primeira decisão é aplicada, mesmo com respostas concorrentes.
+        """
+        if not self._transition(FlowState.FINALIZADO, FlowState.ESPERANDO_MORADOR):
+            logger.info("[Flow] Decisão do morador já registrada, ignorando resposta: '%s'", text)
+            return
+
+        if authorized:
+            logger.info("[Flow] Morador AUTORIZOU a entrada com resposta: '%s'", text)
+        else:
+            logger.info("[Flow] Morador NEGOU a entrada com resposta: '%s'", text)
+
+        # Intent type para mensagem personalizada
+        intent_msg = _INTENT_MSG.get(intent_type, "entrada")
+
+        resident_tmpl = _RESIDENT_AUTHORIZED_TMPL if authorized else _RESIDENT_DENIED_TMPL
+        visitor_tmpl = _VISITOR_AUTHORIZED_TMPL if authorized else _VISITOR_DENIED_TMPL
+        session_manager.enfileirar_resident(session_id, resident_tmpl.format(v=visitor_name, m=intent_msg))
+        session_manager.enfileirar_visitor(session_id, visitor_tmpl.format(m=intent_msg))
+
+        # Salvar resultado da autorização na sessão
+        self.intent_data["authorization_result"] = "authorized" if authorized else "denied"
+
+        # Registrar log especial para sinalizar finalização
+        logger.info("[Flow] %s CONCLUÍDA - estado FINALIZADO", "Autorização" if authorized else "Negação")
+
+        # Iniciar encerramento de forma controlada
+        self._finalizar(session_id, session_manager)
+
     # ----------------------------------------------------
     #  PROCESSO DE CHAMADA AO MORADOR (ASSÍNCRONO)
     # ----------------------------------------------------
@@ -444,22 +560,15 @@ class ConversationFlow:
         """
         Gerencia o processo completo de chamada ao morador de forma assíncrona,
         sem notificar o visitante sobre cada etapa.
+
+        Pré-condição: é sempre agendada via asyncio.run_coroutine_threadsafe no
+        _CALL_LOOP, que já tem loop em execução e mantém a conexão de amqp_pool;
+        por isso não há verificação/criação de loop de eventos aqui.
         """
         # Log detalhado para diagnóstico
-        logger.info(f"[Flow] Iniciando processo de chamada para morador: voip={self.voip_number_morador}, session_id={session_id}")
-        logger.info(f"[Flow] Dados do intent: {self.intent_data}")
-        
-        # Garantir que temos um loop de eventos válido nesta thread
-        try:
-            # Para verificação apenas
-            current_loop = asyncio.get_running_loop()
-            logger.info(f"[Flow] Usando loop de eventos existente: {current_loop}")
-        except RuntimeError:
-            # Isso não deveria acontecer se a coroutine foi iniciada corretamente,
-            # mas adicionamos um tratamento especial por precaução
-            logger.warning(f"[Flow] Não há loop de eventos na thread atual para iniciar_processo_chamada")
-            # Vamos criar um novo event loop, mas isso geralmente não é necessário e pode indicar um erro de design
-            asyncio.set_event_loop(asyncio.new_event_loop())
+        logger.info("[Flow] Iniciando processo de chamada para morador: voip=%s, session_id=%s", self.voip_number_morador, session_id)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[Flow] Dados do intent: %r", self.intent_data)
         
         if not self.voip_number_morador:
             logger.warning("[Flow] voip_number_morador está vazio, não posso discar.")
@@ -467,130 +576,112 @@ class ConversationFlow:
                 session_id,
                 "Não foi possível entrar em contato com o morador. Tente novamente mais tarde."
             )
-            self.state = FlowState.FINALIZADO
+            self._transition(FlowState.FINALIZADO)
             self._finalizar(session_id, session_manager)
             return
 
-        # Mudamos para o estado de processamento em andamento
-        self.state = FlowState.CALLING_IN_PROGRESS
+        # Mudamos para o estado de processamento em andamento (a menos que o morador já tenha atendido)
+        if not self._transition(FlowState.CALLING_IN_PROGRESS, FlowState.CHAMANDO_MORADOR):
+            logger.info("[Flow] Estado %s antes da primeira tentativa; chamada não será iniciada", self.state)
+            return
         
+        # Payload serializado uma única vez e reaproveitado em todas as tentativas
+        body = self._build_clicktocall_body(self.voip_number_morador, session_id)
+
         # Realizar tentativas de chamada sem notificar o visitante
         while self.tentativas_chamada < self.max_tentativas:
             self.tentativas_chamada += 1
-            logger.info(f"[Flow] Tentativa {self.tentativas_chamada} de chamar o morador {self.voip_number_morador}")
+            logger.info("[Flow] Tentativa %d de chamar o morador %s", self.tentativas_chamada, self.voip_number_morador)
             
             try:
                 # Enviar comando para fazer a ligação
-                logger.info(f"[Flow] Enviando clicktocall para {self.voip_number_morador} na tentativa {self.tentativas_chamada}")
+                logger.debug("[Flow] Enviando clicktocall para %s na tentativa %d", self.voip_number_morador, self.tentativas_chamada)
                 
-                success = self.enviar_clicktocall(self.voip_number_morador, session_id)
+                success = await self.enviar_clicktocall(self.voip_number_morador, session_id, body)
                 
                 if not success:
-                    logger.error(f"[Flow] Falha ao enviar clicktocall na tentativa {self.tentativas_chamada}")
+                    logger.error("[Flow] Falha ao enviar clicktocall na tentativa %d", self.tentativas_chamada)
                     # Se falhou no envio e é a última tentativa, sair do loop
                     if self.tentativas_chamada >= self.max_tentativas:
                         break
                     
                     # Extra logging para diagnóstico
-                    logger.error(f"[Flow] Dados para clicktocall que falharam: voip={self.voip_number_morador}, intent={self.intent_data}")
-                    continue  # Tenta novamente na próxima iteração
+                    logger.error("[Flow] Dados para clicktocall que falharam: voip=%s, intent=%r", self.voip_number_morador, self.intent_data)
+                    # Falha conhecida: tenta novamente após um backoff curto
+                    await asyncio.sleep(_RETRY_BACKOFF)
+                    continue
                 
-                logger.info(f"[Flow] AMQP enviado com sucesso para origin={self.voip_number_morador}, tentativa={self.tentativas_chamada}")
-
-                # Aguarda o timeout para ver se o morador atende
-                for _ in range(self.call_timeout_seconds):
-                    await asyncio.sleep(1)  # Verifica a cada 1 segundo
-                    # Se o morador atendeu neste meio tempo, o estado terá mudado
-                    if self.state == FlowState.ESPERANDO_MORADOR:
-                        logger.info(f"[Flow] Morador atendeu na tentativa {self.tentativas_chamada}")
-                        return  # Processo concluído com sucesso
-                
-                # Se chegou aqui, o timeout foi atingido e o morador não atendeu
-                logger.info(f"[Flow] Timeout de {self.call_timeout_seconds}s atingido na tentativa {self.tentativas_chamada}")
+                logger.info("[Flow] AMQP enviado com sucesso para origin=%s, tentativa=%d", self.voip_number_morador, self.tentativas_chamada)
+
+                # Aguarda o morador atender (sinalizado por on_resident_message) até o timeout
+                try:
+                    await asyncio.wait_for(self._answered_event.wait(), timeout=self.call_timeout_seconds)
+                    logger.info("[Flow] Morador atendeu na tentativa %d", self.tentativas_chamada)
+                    return  # Processo concluído com sucesso
+                except asyncio.TimeoutError:
+                    # O morador não atendeu; o prazo completo já serviu de espera, nova tentativa imediata
+                    logger.info("[Flow] Timeout de %ds atingido na tentativa %d", self.call_timeout_seconds, self.tentativas_chamada)
                 
             except Exception as e:
-                logger.error(f"[Flow] Erro inesperado ao processar chamada: {e}")
+                logger.error("[Flow] Erro inesperado ao processar chamada: %s", e)
                 if self.tentativas_chamada >= self.max_tentativas:
                     break  # Sai do loop após a última tentativa falhar
-            
-            # Aguarda um breve período entre tentativas
-            if self.tentativas_chamada < self.max_tentativas:
-                await asyncio.sleep(1)  # Pequeno intervalo entre tentativas
+                await asyncio.sleep(_RETRY_BACKOFF)
         
+        # Finaliza o processo, salvo se o morador atendeu no último instante
+        if not self._transition(FlowState.FINALIZADO, FlowState.CHAMANDO_MORADOR, FlowState.CALLING_IN_PROGRESS):
+            return
+
         # Se todas as tentativas falharam, notifica o visitante
-        logger.info(f"[Flow] Todas as {self.max_tentativas} tentativas de contato com o morador falharam")
+        logger.info("[Flow] Todas as %d tentativas de contato com o morador falharam", self.max_tentativas)
         session_manager.enfileirar_visitor(
             session_id,
             "Não foi possível contatar o morador no momento. Por favor, tente novamente mais tarde."
         )
-        
-        # Finaliza o processo
-        self.state = FlowState.FINALIZADO
         self._finalizar(session_id, session_manager)
 
-    def enviar_clicktocall(self, morador_voip_number: str, guid: str):
-        """
-        Envia solicitação de chamada para o morador via AMQP, garantindo
-        que o mesmo GUID da sessão original seja utilizado como identificador.
+    def _build_clicktocall_body(self, morador_voip_number: str, guid: str) -> Optional[bytes]:
         """
-        rabbit_host = 'mqdev.tecnofy.com.br'
-        rabbit_user = 'fonia'
-        rabbit_password = 'fonia123'
-        rabbit_vhost = 'voip'
-        queue_name = 'api-to-voip1'
-
-        # Melhor logging para diagnóstico
-        logger.info(f"[Flow] AMQP Config: host={rabbit_host}, vhost={rabbit_vhost}, queue={queue_name}")
-        logger.info(f"[Flow] AMQP: Iniciando processo de clicktocall para morador={morador_voip_number}, guid={guid}")
+        Monta e serializa o payload de clicktocall, garantindo que o mesmo GUID
+        da sessão original seja utilizado como identificador.
 
+        Returns:
+            bytes: Corpo JSON compacto, ou None se os dados forem inválidos
+        """
         # Verificação de segurança - GUID não pode estar vazio
         if not guid or len(guid) < 8:
-            logger.error(f"[Flow] GUID inválido para clicktocall: '{guid}'")
-            return False
+            logger.error("[Flow] GUID inválido para clicktocall: '%s'", guid)
+            return None
 
         # Verificação de segurança - número do morador não pode estar vazio
         if not morador_voip_number:
-            logger.error(f"[Flow] Número do morador inválido: '{morador_voip_number}'")
-            return False
+            logger.error("[Flow] Número do morador inválido: '%s'", morador_voip_number)
+            return None
 
         try:
             # Se temos um extension_manager, tentamos obter o ramal de retorno correto
             ramal_retorno = morador_voip_number
             if self.extension_manager:
-                logger.info(f"[Flow] AMQP: Tentando obter ramal dinâmico com extension_manager para guid={guid}")
-                ext_info = self.extension_manager.get_extension_info(call_id=guid)
-                if ext_info:
-                    ramal_retorno = ext_info.get('ramal_retorno', morador_voip_number)
-                    logger.info(f"[Flow] AMQP: Usando ramal de retorno dinâmico: {ramal_retorno} para sessão {guid}")
+                # O call_id não muda durante a sessão: consulta apenas na primeira tentativa
+                if self._ext_info is None:
+                    logger.info("[Flow] AMQP: Tentando obter ramal dinâmico com extension_manager para guid=%s", guid)
+                    self._ext_info = self.extension_manager.get_extension_info(call_id=guid) or {}
+                if self._ext_info:
+                    ramal_retorno = self._ext_info.get('ramal_retorno', morador_voip_number)
+                    logger.info("[Flow] AMQP: Usando ramal de retorno dinâmico: %s para sessão %s", ramal_retorno, guid)
                 else:
-                    logger.warning(f"[Flow] AMQP: Usando ramal de retorno padrão: {morador_voip_number}, pois não encontrei configuração dinâmica")
+                    logger.warning("[Flow] AMQP: Usando ramal de retorno padrão: %s, pois não encontrei configuração dinâmica", morador_voip_number)
             else:
-                logger.warning(f"[Flow] AMQP: Extension manager não disponível, usando ramal padrão: {morador_voip_number}")
-
-            # Configuração da conexão com parâmetros aprimorados
-            logger.info(f"[Flow] AMQP: Criando credenciais para conexão...")
-            credentials = pika.PlainCredentials(rabbit_user, rabbit_password)
-            parameters = pika.ConnectionParameters(
-                host=rabbit_host,
-                virtual_host=rabbit_vhost,
-                credentials=credentials,
-                connection_attempts=2,  # Tentar conectar 2 vezes
-                retry_delay=1,          # 1 segundo entre tentativas
-                socket_timeout=5        # 5 segundos de timeout
-            )
-
-            logger.info(f"[Flow] AMQP: Tentando conexão com {rabbit_host}...")
-            connection = pika.BlockingConnection(parameters)
-            logger.info(f"[Flow] AMQP: Conexão estabelecida com sucesso!")
-            
-            channel = connection.channel()
-            logger.info(f"[Flow] AMQP: Canal criado, declarando fila {queue_name}...")
-            
-            channel.queue_declare(queue=queue_name, durable=True)
-            logger.info(f"[Flow] AMQP: Fila declarada com sucesso!")
+                logger.warning("[Flow] AMQP: Extension manager não disponível, usando ramal padrão: %s", morador_voip_number)
 
             # Timestamp atual para o evento
-            current_timestamp = int(time.time())
+            current_timestamp = time.time_ns() // 1_000_000_000
+
+            # Caminho rápido: campos seguros preenchem o template sem passar pelo serializador
+            ramal_retorno = str(ramal_retorno)
+            if _SAFE_FIELD_RE.match(guid) and _SAFE_FIELD_RE.match(ramal_retorno):
+                guid_bytes = guid.encode()
+                return _PAYLOAD_TMPL % (guid_bytes, ramal_retorno.encode(), guid_bytes, current_timestamp)
 
             # IMPORTANTE: Garantir que o mesmo GUID da sessão seja usado
             # na chamada para o morador, para que os contextos se conectem
@@ -610,32 +701,68 @@ class ConversationFlow:
                 }
             }
 
-            payload_json = json.dumps(payload)
-            logger.info(f"[Flow] AMQP: Enviando payload: {payload_json}")
+            if orjson is not None:
+                return orjson.dumps(payload)
+            return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        except Exception as e:
+            logger.error("[Flow] AMQP: Erro ao montar payload de clicktocall: %s", e, exc_info=True)
+            return None
+
+    async def enviar_clicktocall(self, morador_voip_number: str, guid: str, body: Optional[bytes] = None):
+        """
+        Envia solicitação de chamada para o morador via AMQP.
+
+        A publicação usa a conexão persistente de amqp_pool e aguarda a
+        confirmação do broker (publisher confirms) por até call_timeout_seconds;
+        um nack retorna False imediatamente.
+
+        Não há E/S bloqueante neste caminho: a conexão é uma AsyncioConnection
+        no _CALL_LOOP, separado do loop do audiosocket, então um broker lento
+        não congela o áudio das demais sessões e dispensa um executor.
+
+        Args:
+            morador_voip_number: Ramal do morador
+            guid: GUID da sessão original
+            body: Payload já serializado por _build_clicktocall_body (reaproveitado
+                  entre tentativas); montado aqui se não informado
+        """
+        queue_name = amqp_pool.CLICKTOCALL_QUEUE
 
-            channel.basic_publish(
-                exchange='',
-                routing_key=queue_name,
-                body=payload_json
+        # Melhor logging para diagnóstico
+        logger.info("[Flow] AMQP Config: host=%s, vhost=%s, queue=%s", amqp_pool.RABBIT_HOST, amqp_pool.RABBIT_VHOST, queue_name)
+        logger.info("[Flow] AMQP: Iniciando processo de clicktocall para morador=%s, guid=%s", morador_voip_number, guid)
+
+        if body is None:
+            body = self._build_clicktocall_body(morador_voip_number, guid)
+            if body is None:
+                return False
+
+        try:
+            logger.info("[Flow] AMQP: Enviando payload: %s", body)
+
+            acked = await asyncio.wait_for(
+                amqp_pool.publish(queue_name, body, guid),
+                timeout=self.call_timeout_seconds
             )
+            if not acked:
+                logger.error("[Flow] AMQP: Broker rejeitou (nack) a mensagem de clicktocall para guid=%s", guid)
+                return False
             
-            logger.info(f"[Flow] AMQP: Mensagem enviada com sucesso: origin={ramal_retorno}, guid={guid}, timestamp={current_timestamp}")
-            connection.close()
-            logger.info(f"[Flow] AMQP: Conexão fechada com sucesso!")
+            logger.info("[Flow] AMQP: Mensagem enviada com sucesso: morador=%s, guid=%s", morador_voip_number, guid)
             return True
             
         except pika.exceptions.AMQPConnectionError as e:
-            logger.error(f"[Flow] AMQP: Erro de conexão ao servidor RabbitMQ: {e}")
-            logger.error(f"[Flow] AMQP: Detalhes da conexão: host={rabbit_host}, vhost={rabbit_vhost}, user={rabbit_user}")
+            logger.error("[Flow] AMQP: Erro de conexão ao servidor RabbitMQ: %s", e)
+            logger.error("[Flow] AMQP: Detalhes da conexão: host=%s, vhost=%s, user=%s", amqp_pool.RABBIT_HOST, amqp_pool.RABBIT_VHOST, amqp_pool.RABBIT_USER)
             return False
-        except pika.exceptions.ChannelError as e:
-            logger.error(f"[Flow] AMQP: Erro no canal RabbitMQ (possivelmente a fila não existe): {e}")
+        except pika.exceptions.AMQPChannelError as e:
+            logger.error("[Flow] AMQP: Erro no canal RabbitMQ (possivelmente a fila não existe): %s", e)
             return False
-        except json.JSONDecodeError as e:
-            logger.error(f"[Flow] AMQP: Erro ao serializar payload JSON: {e}")
+        except asyncio.TimeoutError:
+            logger.error("[Flow] AMQP: Timeout aguardando confirmação do broker para guid=%s", guid)
             return False
         except Exception as e:
-            logger.error(f"[Flow] AMQP: Erro inesperado ao enviar clicktocall: {e}", exc_info=True)
+            logger.error("[Flow] AMQP: Erro inesperado ao enviar clicktocall: %s", e, exc_info=True)
             return False
     # ----------------------------------------------------
     # FINALIZAR (chamar end_session, etc.)
@@ -649,77 +776,45 @@ class ConversationFlow:
         3. O session_manager sinaliza que as conexões devem ser encerradas
         4. As tasks assíncronas de audiosocket detectam o sinal e encerram graciosamente
         """
-        logger.info(f"[Flow] Iniciando encerramento controlado da sessão {session_id}")
+        logger.info("[Flow] Iniciando encerramento controlado da sessão %s", session_id)
+
+        # Interromper tentativas de chamada pendentes (no-op se o processo já terminou)
+        if self.calling_task is not None and not self.calling_task.done():
+            self.calling_task.cancel()
         
         # Carregar intenções
         authorization_result = self.intent_data.get("authorization_result", "")
         intent_type = self.intent_data.get("intent_type", "entrada")
-        logger.info(f"[Flow] Finalizando com authorization_result={authorization_result}, intent_type={intent_type}")
+        logger.info("[Flow] Finalizando com authorization_result=%s, intent_type=%s", authorization_result, intent_type)
             
         # Mensagens para os participantes
-        if self.state in [FlowState.CHAMANDO_MORADOR, FlowState.CALLING_IN_PROGRESS, FlowState.ESPERANDO_MORADOR, FlowState.FINALIZADO]:
+        if self.state in _RESIDENT_INVOLVED_STATES:
             # Se o morador estava envolvido, avisar ambos
-            session_manager.enfileirar_resident(
-                session_id, 
-                "A conversa foi finalizada. Obrigado pela sua resposta."
-            )
-            
-            # O texto para o visitante depende do resultado da autorização
-            authorization_result = self.intent_data.get("authorization_result", "")
-            intent_type = self.intent_data.get("intent_type", "entrada")
+            session_manager.enfileirar_resident(session_id, _RESIDENT_FINAL_MSG)
             
             # Verificar se é o caso de teste para o KIND_HANGUP
-            is_test_hangup = self.intent_data.get("test_hangup", False)
-            
-            if is_test_hangup:
+            if self.intent_data.get("test_hangup", False):
                 # Definir flag específica para teste de hangup
                 session = session_manager.get_session(session_id)
                 if session:
                     session.intent_data["test_hangup"] = True
-                    logger.info(f"[Flow] Flag de teste KIND_HANGUP ativada para sessão {session_id}")
+                    logger.info("[Flow] Flag de teste KIND_HANGUP ativada para sessão %s", session_id)
                 
                 # Usar mensagem de finalização específica para teste
-                session_manager.enfileirar_visitor(
-                    session_id,
-                    "A chamada com o morador foi finalizada. Obrigado por utilizar nosso sistema."
-                )
-            elif authorization_result == "authorized":
-                if intent_type == "entrega":
-                    session_manager.enfileirar_visitor(
-                        session_id,
-                        "Sua entrega foi autorizada pelo morador. Finalizando a chamada."
-                    )
-                elif intent_type == "visita":
-                    session_manager.enfileirar_visitor(
-                        session_id, 
-                        "Sua visita foi autorizada pelo morador. Finalizando a chamada."
-                    )
-                else:
-                    session_manager.enfileirar_visitor(
-                        session_id,
-                        "Sua entrada foi autorizada pelo morador. Finalizando a chamada."
-                    )
-            elif authorization_result == "denied":
-                session_manager.enfileirar_visitor(
-                    session_id,
-                    "Sua entrada não foi autorizada pelo morador. Finalizando a chamada."
-                )
+                visitor_msg = _VISITOR_FINAL_DEFAULT
             else:
-                session_manager.enfileirar_visitor(
-                    session_id,
-                    "A chamada com o morador foi finalizada. Obrigado por utilizar nosso sistema."
-                )
+                # O texto para o visitante depende do resultado da autorização
+                visitor_msg = (_VISITOR_FINAL_MSG.get((authorization_result, intent_type))
+                               or _VISITOR_FINAL_MSG.get((authorization_result, None), _VISITOR_FINAL_DEFAULT))
+            session_manager.enfileirar_visitor(session_id, visitor_msg)
         else:
             # Caso padrão (apenas visitante)
-            session_manager.enfileirar_visitor(
-                session_id,
-                "Conversa finalizada. Obrigado por utilizar nosso sistema."
-            )
+            session_manager.enfileirar_visitor(session_id, _VISITOR_ONLY_FINAL_MSG)
         
         # Utilizar encerramento ativo KIND_HANGUP após um delay para permitir que todas as mensagens
         # sejam enviadas e ouvidas
         self._schedule_active_hangup(session_id, session_manager)
-        logger.info(f"[Flow] Finalização programada com encerramento ativo KIND_HANGUP para sessão {session_id}")
+        logger.info("[Flow] Finalização programada com encerramento ativo KIND_HANGUP para sessão %s", session_id)
 
     def _schedule_active_hangup(self, session_id: str, session_manager, delay=5.0):
         """
@@ -731,82 +826,96 @@ class ConversationFlow:
             session_manager: Gerenciador de sessões
             delay: Tempo em segundos para aguardar antes de enviar KIND_HANGUP (padrão: 5s)
         """
-        import asyncio
-        
         async def send_hangup_after_delay():
-            # Aguardar o delay para permitir que as mensagens sejam enviadas
-            await asyncio.sleep(delay)
-            
+            # O delay já foi aplicado pelo agendamento (call_later ou sleep no fallback)
             # Verificar se a sessão ainda existe
             session = session_manager.get_session(session_id)
             if not session:
-                logger.info(f"[Flow] Sessão {session_id} já foi encerrada antes do KIND_HANGUP")
+                logger.info("[Flow] Sessão %s já foi encerrada antes do KIND_HANGUP", session_id)
                 return
                 
             try:
                 # Importar ResourceManager para acessar conexões ativas
                 from extensions.resource_manager import resource_manager
-                import struct
-                
-                # Enviar KIND_HANGUP para o visitante
-                visitor_conn = resource_manager.get_active_connection(session_id, "visitor")
-                if visitor_conn and 'writer' in visitor_conn:
-                    try:
-                        logger.info(f"[Flow] Enviando KIND_HANGUP ativo para visitante na sessão {session_id}")
-                        visitor_conn['writer'].write(struct.pack('>B H', 0x00, 0))
-                        await visitor_conn['writer'].drain()
-                    except ConnectionResetError:
-                        logger.info(f"[Flow] Conexão do visitante já foi resetada durante envio de KIND_HANGUP - comportamento normal")
-                    except Exception as e:
-                        logger.warning(f"[Flow] Erro ao enviar KIND_HANGUP para visitante: {e}")
-                else:
-                    logger.warning(f"[Flow] Conexão do visitante não encontrada para enviar KIND_HANGUP na sessão {session_id}")
                 
-                # Enviar KIND_HANGUP para o morador (se existir conexão)
-                resident_conn = resource_manager.get_active_connection(session_id, "resident")
-                if resident_conn and 'writer' in resident_conn:
+                async def _hangup_one(conn, label):
+                    if conn is None or conn.writer is None:
+                        if label == "visitante":
+                            logger.warning("[Flow] Conexão do visitante não encontrada para enviar KIND_HANGUP na sessão %s", session_id)
+                        return
                     try:
-                        logger.info(f"[Flow] Enviando KIND_HANGUP ativo para morador na sessão {session_id}")
-                        resident_conn['writer'].write(struct.pack('>B H', 0x00, 0))
-                        await resident_conn['writer'].drain()
+                        logger.info("[Flow] Enviando KIND_HANGUP ativo para %s na sessão %s", label, session_id)
+                        conn.writer.write(KIND_HANGUP_FRAME)
+                        await conn.writer.drain()
                     except ConnectionResetError:
-                        logger.info(f"[Flow] Conexão do morador já foi resetada durante envio de KIND_HANGUP - comportamento normal")
+                        logger.info("[Flow] Conexão do %s já foi resetada durante envio de KIND_HANGUP - comportamento normal", label)
                     except Exception as e:
-                        logger.warning(f"[Flow] Erro ao enviar KIND_HANGUP para morador: {e}")
+                        logger.warning("[Flow] Erro ao enviar KIND_HANGUP para %s: %s", label, e)
+
+                # Os dois sockets são independentes: envia KIND_HANGUP para visitante e morador em paralelo
+                await asyncio.gather(
+                    _hangup_one(resource_manager.get_active_connection(session_id, "visitor"), "visitante"),
+                    _hangup_one(resource_manager.get_active_connection(session_id, "resident"), "morador"),
+                    return_exceptions=True,
+                )
                 
-                # Após enviar os KIND_HANGUP, aguardar um pouco e finalizar a sessão completamente
-                await asyncio.sleep(1.0)
+                # Após enviar os KIND_HANGUP, sinalizar o encerramento e aguardar as tarefas
+                # de audiosocket concluírem a terminação (em vez de um sleep fixo)
                 session_manager.end_session(session_id)
+                if asyncio.get_running_loop() is self._loop:
+                    try:
+                        await asyncio.wait_for(session.termination_complete_event.wait(), timeout=_TERMINATION_WAIT_TIMEOUT)
+                        logger.info("[Flow] Sessão %s encerrada pelas tarefas de audiosocket", session_id)
+                        return
+                    except asyncio.TimeoutError:
+                        logger.info("[Flow] Terminação da sessão %s não concluída em %ss, forçando encerramento", session_id, _TERMINATION_WAIT_TIMEOUT)
+                else:
+                    await asyncio.sleep(1.0)
 
                 from audiosocket_handler import encerrar_conexao
                 # Encerrar conexões de forma segura
                 await encerrar_conexao(session_id, "visitor")
                 await encerrar_conexao(session_id, "morador")
+                session_manager._complete_session_termination(session_id)
                     
             except Exception as e:
-                logger.error(f"[Flow] Erro ao enviar KIND_HANGUP ativo: {e}", exc_info=True)
+                logger.error("[Flow] Erro ao enviar KIND_HANGUP ativo: %s", e, exc_info=True)
                 
                 # Em caso de erro, tentar finalizar a sessão do modo tradicional
                 session_manager.end_session(session_id)
         
-        # Usar a mesma estratégia com thread separada
-        import threading
-        
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            # Executa no próprio loop do audiosocket, sem thread nem loop novos
+            def start_hangup():
+                self.hangup_task = loop.create_task(send_hangup_after_delay())
+
+            try:
+                running_loop = asyncio.get_running_loop()
+            except RuntimeError:
+                running_loop = None
+
+            if running_loop is loop:
+                loop.call_later(delay, start_hangup)
+            else:
+                loop.call_soon_threadsafe(loop.call_later, delay, start_hangup)
+            logger.info("[Flow] Hangup agendado em %ss no loop do audiosocket para session_id=%s", delay, session_id)
+            return
+
+        async def sleep_and_hangup():
+            await asyncio.sleep(delay)
+            await send_hangup_after_delay()
+
         def run_async_hangup():
-            """Função auxiliar para executar o hangup em uma thread separada"""
+            """Fallback sem loop do audiosocket: executa o hangup em uma thread do pool"""
             try:
-                logger.info(f"[Flow] Iniciando thread para executar hangup para session_id={session_id}")
+                logger.info("[Flow] Iniciando thread para executar hangup para session_id=%s", session_id)
                 # asyncio.run() vai criar um novo event loop e executar a coroutine nele
-                asyncio.run(send_hangup_after_delay())
-                logger.info(f"[Flow] Thread de hangup concluída com sucesso")
+                asyncio.run(sleep_and_hangup())
+                logger.info("[Flow] Thread de hangup concluída com sucesso")
             except Exception as e:
-                logger.error(f"[Flow] Erro em thread de hangup: {e}", exc_info=True)
-        
-        # Iniciar a thread
-        logger.info(f"[Flow] Criando thread para hangup com session_id={session_id}")
-        hangup_thread = threading.Thread(target=run_async_hangup)
-        hangup_thread.daemon = True  # Thread em segundo plano
-        hangup_thread.start()
+                logger.error("[Flow] Erro em thread de hangup: %s", e, exc_info=True)
         
-        # Não aguardamos a conclusão da tarefa para não bloquear o fluxo
-        logger.info(f"[Flow] Thread para hangup iniciada")
+        # Submeter ao pool; não aguardamos a conclusão para não bloquear o fluxo
+        logger.info("[Flow] Agendando hangup no pool de threads para session_id=%s", session_id)
+        self.hangup_task = _CALL_EXEC.submit(run_async_hangup)
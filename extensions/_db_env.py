@@ -0,0 +1,20 @@
+import os
+from functools import lru_cache
+
+from dotenv import load_dotenv
+
+
+@lru_cache(maxsize=1)
+def _db_config():
+    """
+    Parâmetros de conexão com o PostgreSQL, lidos do ambiente (e do .env) uma única vez.
+    O dicionário é compartilhado entre DBConnector e PostgresListener: não deve ser modificado.
+    """
+    load_dotenv()
+    return {
+        'dbname': os.getenv('DB_NAME', 'postgres'),
+        'user': os.getenv('DB_USER', 'admincd'),
+        'password': os.getenv('DB_PASSWORD', 'Isabela@2022!!'),
+        'host': os.getenv('DB_HOST', 'dev-postgres-cd.postgres.database.azure.com'),
+        'port': os.getenv('DB_PORT', '5432'),
+    }
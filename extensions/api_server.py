@@ -1,24 +1,81 @@
 import logging
 import json
 from aiohttp import web
+from multidict import CIMultiDict
+try:
+    import orjson
+except ImportError:
+    orjson = None
 import asyncio
-from typing import Dict, Any
+import hashlib
+import struct
+import time
+from functools import partial
+from typing import Awaitable, Callable, Dict, Any, List, Optional, Tuple
 
 from .server_manager import ServerManager
 from .config_persistence import ConfigPersistence
 from .db_connector import DBConnector
+from .resource_manager import resource_manager
+# server_manager já importa audiosocket_handler no carregamento, então não há ciclo novo aqui
+from audiosocket_handler import session_manager
 
 logger = logging.getLogger(__name__)
 
+# Frame KIND_HANGUP do AudioSocket (tipo 0x00, payload vazio), empacotado uma única vez
+KIND_HANGUP_FRAME = struct.pack('>B H', 0x00, 0)
+
+# Tempo de validade do cache de extensões lidas do banco (clientes que fazem polling)
+EXTENSIONS_CACHE_TTL = 5.0
+
+# Opções do orjson avaliadas uma única vez (configs podem ter chaves não-string)
+_ORJSON_OPTS = orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+
+def _dumps(obj) -> bytes:
+    """Serializa um item para JSON compacto (orjson quando disponível)."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=_ORJSON_OPTS)
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+# Cabeçalhos das respostas JSON, montados uma única vez
+_JSON_HEADERS = CIMultiDict({'Content-Type': 'application/json; charset=utf-8'})
+
+
+def _json(obj, status: int = 200) -> web.Response:
+    """Resposta JSON serializada por _dumps, com os cabeçalhos pré-montados."""
+    return web.Response(body=_dumps(obj), status=status, headers=_JSON_HEADERS)
+
 class APIServer:
     """
     Servidor HTTP simples para gerenciar os ramais de IA remotamente.
     Fornece endpoints para status, atualização de configurações, etc.
     """
     
-    def __init__(self, server_manager: ServerManager, config_persistence: ConfigPersistence):
+    def __init__(self, server_manager: ServerManager, config_persistence: ConfigPersistence,
+                 db_connector: Optional[DBConnector] = None,
+                 refresh_handler: Optional[Callable[[List[Dict[str, Any]]], Awaitable[Tuple[int, int, int]]]] = None):
         self.server_manager = server_manager
+        # Quem mantém as configurações canônicas (ExtensionManager.refresh_configurations);
+        # sem ele, o refresh atualiza servidores e arquivo diretamente
+        self.refresh_handler = refresh_handler
         self.config_persistence = config_persistence
+        self.db_connector = db_connector or DBConnector()
+
+        # Cache das extensões do banco, compartilhado entre requisições concorrentes
+        self._ext_cache: Optional[List[Dict[str, Any]]] = None
+        self._ext_cache_ts = 0.0
+        self._ext_cache_ttl = EXTENSIONS_CACHE_TTL
+        self._ext_lock = asyncio.Lock()
+        # Corpo serializado + ETag do /api/extensions, válidos enquanto a lista em cache não mudar
+        self._ext_body_src: Optional[List[Dict[str, Any]]] = None
+        self._ext_body = b''
+        self._ext_etag = ''
+
+        # Limpeza adiada por call_id: um novo hangup substitui (cancela) a limpeza anterior
+        self._pending_cleanups: Dict[str, asyncio.Task] = {}
+
         self.app = web.Application()
         self.setup_routes()
     
@@ -30,32 +87,37 @@ class APIServer:
         self.app.router.add_post('/api/restart', self.restart_extension)
         self.app.router.add_post('/api/hangup', self.hangup_call)
     
+    async def _get_extensions_cached(self, force: bool = False) -> List[Dict[str, Any]]:
+        """
+        Retorna as extensões do banco, reaproveitando a última leitura por até
+        EXTENSIONS_CACHE_TTL segundos. A consulta (bloqueante) roda no executor
+        padrão para não travar o loop do aiohttp; o lock evita consultas duplicadas
+        quando várias requisições encontram o cache expirado ao mesmo tempo.
+
+        Args:
+            force: Ignora o cache e consulta o banco (usado pelo /api/refresh)
+        """
+        async with self._ext_lock:
+            if not force and self._ext_cache is not None and \
+                    time.monotonic() - self._ext_cache_ts < self._ext_cache_ttl:
+                return self._ext_cache
+
+            loop = asyncio.get_running_loop()
+            db_configs = await loop.run_in_executor(None, self.db_connector.get_extensions)
+            # Lista vazia indica falha no banco (get_extensions retorna [] em erro): não cachear
+            if db_configs:
+                self._ext_cache = db_configs
+                self._ext_cache_ts = time.monotonic()
+            return db_configs
+
     async def get_status(self, request: web.Request) -> web.Response:
         """
         Retorna o status de todos os servidores de ramais ativos.
         
         URL: GET /api/status
         """
-        extensions = []
-        
-        for extension_id, server_data in self.server_manager.servers.items():
-            config = server_data['config']
-            extensions.append({
-                "id": extension_id,
-                "ramal_ia": config['ramal_ia'],
-                "ramal_retorno": config['ramal_retorno'],
-                "ip": config['ip_servidor'],
-                "porta_ia": config['porta_ia'],
-                "porta_retorno": config['porta_retorno'],
-                "condominio_id": config['condominio_id'],
-                "status": "ativo"
-            })
-        
-        return web.json_response({
-            "status": "success",
-            "total_extensions": len(extensions),
-            "extensions": extensions
-        })
+        # Snapshot pré-serializado pelo ServerManager (invalidado ao iniciar/parar ramais)
+        return web.Response(body=self.server_manager.get_status_bytes(), headers=_JSON_HEADERS)
     
     async def refresh_config(self, request: web.Request) -> web.Response:
         """
@@ -64,22 +126,26 @@ class APIServer:
         URL: POST /api/refresh
         """
         try:
-            # Obter novas configurações do banco
-            db_configs = self.db_connector.get_extensions()
+            # Obter novas configurações do banco (sempre consulta, e atualiza o cache)
+            db_configs = await self._get_extensions_cached(force=True)
             
             if not db_configs:
-                return web.json_response({
+                return _json({
                     "status": "error",
                     "message": "Não foi possível obter configurações do banco de dados"
                 }, status=500)
             
-            # Atualizar servidores com novas configurações
-            removed, updated, added = await self.server_manager.restart_servers(db_configs)
-            
-            # Persistir configurações localmente
-            self.config_persistence.save_configs(db_configs)
+            if self.refresh_handler is not None:
+                # Atualiza configurações em memória, arquivo local e servidores
+                removed, updated, added = await self.refresh_handler(db_configs)
+            else:
+                # Atualizar servidores com novas configurações
+                removed, updated, added = await self.server_manager.restart_servers(db_configs)
+                
+                # Persistir configurações localmente
+                await self.config_persistence.save_configs_async(db_configs)
             
-            return web.json_response({
+            return _json({
                 "status": "success",
                 "message": "Configurações atualizadas com sucesso",
                 "stats": {
@@ -92,7 +158,7 @@ class APIServer:
         
         except Exception as e:
             logger.error(f"Erro ao atualizar configurações: {e}")
-            return web.json_response({
+            return _json({
                 "status": "error",
                 "message": f"Erro ao atualizar configurações: {str(e)}"
             }, status=500)
@@ -104,18 +170,32 @@ class APIServer:
         URL: GET /api/extensions
         """
         try:
-            db_configs = self.db_connector.get_extensions()
-            return web.json_response({
-                "status": "success",
-                "total": len(db_configs),
-                "extensions": db_configs
-            })
+            db_configs = await self._get_extensions_cached()
         except Exception as e:
             logger.error(f"Erro ao obter extensões: {e}")
-            return web.json_response({
+            return _json({
                 "status": "error",
                 "message": f"Erro ao obter extensões: {str(e)}"
             }, status=500)
+
+        # Serializa e calcula o ETag apenas quando a lista mudou (o cache devolve o mesmo objeto)
+        if db_configs is not self._ext_body_src:
+            self._ext_body = _dumps({
+                "status": "success",
+                "total": len(db_configs),
+                "extensions": db_configs
+            })
+            self._ext_etag = '"%s"' % hashlib.blake2b(self._ext_body, digest_size=12).hexdigest()
+            self._ext_body_src = db_configs
+        
+        # Cliente já tem esta versão: 304 sem corpo
+        if_none_match = request.headers.get('If-None-Match', '')
+        if if_none_match == '*' or self._ext_etag in (tag.strip() for tag in if_none_match.split(',')):
+            return web.Response(status=304, headers={'ETag': self._ext_etag})
+        
+        headers = CIMultiDict(_JSON_HEADERS)
+        headers['ETag'] = self._ext_etag
+        return web.Response(body=self._ext_body, headers=headers)
     
     async def restart_extension(self, request: web.Request) -> web.Response:
         """
@@ -129,46 +209,42 @@ class APIServer:
             
             if 'extension_id' in data:
                 extension_id = int(data['extension_id'])
-                if extension_id in self.server_manager.servers:
-                    config = self.server_manager.servers[extension_id]['config']
-                    await self.server_manager.stop_server(extension_id)
-                    await self.server_manager.start_server(config)
-                    return web.json_response({
+                # restart_server retorna False se o ramal foi removido enquanto aguardava o lock
+                if (extension_id in self.server_manager.servers
+                        and await self.server_manager.restart_server(extension_id)):
+                    return _json({
                         "status": "success",
                         "message": f"Ramal ID {extension_id} reiniciado com sucesso"
                     })
                 else:
-                    return web.json_response({
+                    return _json({
                         "status": "error",
                         "message": f"Ramal ID {extension_id} não encontrado"
                     }, status=404)
             
             elif 'ramal' in data:
                 ramal = data['ramal']
-                if ramal in self.server_manager.extension_to_id:
-                    extension_id = self.server_manager.extension_to_id[ramal]
-                    config = self.server_manager.servers[extension_id]['config']
-                    await self.server_manager.stop_server(extension_id)
-                    await self.server_manager.start_server(config)
-                    return web.json_response({
+                extension_id = self.server_manager.extension_to_id.get(ramal)
+                if extension_id is not None and await self.server_manager.restart_server(extension_id):
+                    return _json({
                         "status": "success",
                         "message": f"Ramal {ramal} reiniciado com sucesso"
                     })
                 else:
-                    return web.json_response({
+                    return _json({
                         "status": "error",
                         "message": f"Ramal {ramal} não encontrado"
                     }, status=404)
             
             else:
-                return web.json_response({
+                return _json({
                     "status": "error",
                     "message": "É necessário fornecer extension_id ou ramal"
                 }, status=400)
         
         except Exception as e:
             logger.error(f"Erro ao reiniciar ramal: {e}")
-            return web.json_response({
+            return _json({
                 "status": "error",
                 "message": f"Erro ao reiniciar ramal: {str(e)}"
             }, status=500)
@@ -178,16 +254,13 @@ class APIServer:
         Envia sinal de hangup (KIND_HANGUP, 0x00) para uma chamada ativa.
         
         URL: POST /api/hangup
-        Body: {"call_id": "uuid-da-chamada", "role": "visitor|resident"}
+        Body: {"call_id": "uuid-da-chamada", "role": "visitor|resident|both"}
         """
         try:
-            from audiosocket_handler import session_manager
-            import struct
-            
             data = await request.json()
             
             if 'call_id' not in data:
-                return web.json_response({
+                return _json({
                     "status": "error",
                     "message": "call_id é obrigatório"
                 }, status=400)
@@ -195,81 +268,114 @@ class APIServer:
             call_id = data['call_id']
             role = data.get('role', 'visitor')  # Padrão é visitante
             
-            # Validar role
-            if role not in ['visitor', 'resident']:
-                return web.json_response({
+            # Validar role ("both" encerra as duas pernas na mesma requisição)
+            if role not in ['visitor', 'resident', 'both']:
+                return _json({
                     "status": "error",
-                    "message": "role deve ser 'visitor' ou 'resident'"
+                    "message": "role deve ser 'visitor', 'resident' ou 'both'"
                 }, status=400)
             
             # Verificar se a sessão existe
             session = session_manager.get_session(call_id)
             if not session:
-                return web.json_response({
+                return _json({
                     "status": "error",
                     "message": f"Sessão {call_id} não encontrada"
                 }, status=404)
             
-            # Obter a conexão ativa da sessão através do ResourceManager
-            from extensions.resource_manager import resource_manager
+            # Obter as conexões ativas da sessão através do ResourceManager
+            roles = ['visitor', 'resident'] if role == 'both' else [role]
+            writers = []
+            for current_role in roles:
+                connection = resource_manager.get_active_connection(call_id, current_role)
+                if not connection:
+                    if role == 'both':
+                        continue  # A outra perna pode já ter desligado
+                    return _json({
+                        "status": "error",
+                        "message": f"Conexão ativa não encontrada para {call_id} ({role})"
+                    }, status=404)
+                
+                writer = connection.writer
+                if not writer:
+                    if role == 'both':
+                        continue
+                    return _json({
+                        "status": "error",
+                        "message": f"Writer não disponível para {call_id} ({role})"
+                    }, status=500)
+                writers.append((current_role, writer))
             
-            connection = resource_manager.get_active_connection(call_id, role)
-            if not connection:
-                return web.json_response({
+            if not writers:
+                return _json({
                     "status": "error",
                     "message": f"Conexão ativa não encontrada para {call_id} ({role})"
                 }, status=404)
             
-            # Enviar KIND_HANGUP (0x00) com payload length 0
-            writer = connection.get('writer')
-            if not writer:
-                return web.json_response({
-                    "status": "error",
-                    "message": f"Writer não disponível para {call_id} ({role})"
-                }, status=500)
-            
-            # Enviar KIND_HANGUP (0x00) com tratamento de erro
-            try:
-                writer.write(struct.pack('>B H', 0x00, 0))
-                await writer.drain()
-            except ConnectionResetError:
-                logger.info(f"Conexão já foi resetada durante envio de KIND_HANGUP para {call_id} ({role}) - comportamento normal")
-            except Exception as e:
-                logger.error(f"Erro ao enviar KIND_HANGUP para {call_id} ({role}): {e}")
-                return web.json_response({
-                    "status": "error",
-                    "message": f"Erro ao enviar KIND_HANGUP: {str(e)}"
-                }, status=500)
+            # Enviar KIND_HANGUP (0x00) para todas as pernas em paralelo
+            results = await asyncio.gather(
+                *(self._send_hangup(writer, call_id, current_role) for current_role, writer in writers),
+                return_exceptions=True
+            )
+            for (current_role, _), result in zip(writers, results):
+                if isinstance(result, Exception):
+                    logger.error(f"Erro ao enviar KIND_HANGUP para {call_id} ({current_role}): {result}")
+                    return _json({
+                        "status": "error",
+                        "message": f"Erro ao enviar KIND_HANGUP: {str(result)}"
+                    }, status=500)
             
             # Definir flag para indicar teste de hangup na sessão
             session.intent_data["test_hangup"] = True
             
             # Aguardar um momento e então encerrar a sessão completamente
-            asyncio.create_task(self._cleanup_session_after_delay(call_id, session_manager))
+            old_task = self._pending_cleanups.pop(call_id, None)
+            if old_task:
+                old_task.cancel()
+            task = asyncio.create_task(self._cleanup_session_after_delay(call_id, session_manager))
+            self._pending_cleanups[call_id] = task
+            task.add_done_callback(partial(self._forget_cleanup, call_id))
             
             logger.info(f"KIND_HANGUP enviado com sucesso para {call_id} ({role})")
-            return web.json_response({
+            return _json({
                 "status": "success",
                 "message": f"KIND_HANGUP enviado com sucesso para {call_id} ({role})"
             })
             
         except Exception as e:
             logger.error(f"Erro ao enviar KIND_HANGUP: {e}", exc_info=True)
-            return web.json_response({
+            return _json({
                 "status": "error",
                 "message": f"Erro ao enviar KIND_HANGUP: {str(e)}"
             }, status=500)
     
+    async def _send_hangup(self, writer, call_id: str, role: str) -> None:
+        """Escreve o frame KIND_HANGUP e aguarda o drain; conexão já resetada não é erro."""
+        try:
+            writer.write(KIND_HANGUP_FRAME)
+            await writer.drain()
+        except ConnectionResetError:
+            logger.info(f"Conexão já foi resetada durante envio de KIND_HANGUP para {call_id} ({role}) - comportamento normal")
+    
     async def _cleanup_session_after_delay(self, call_id, session_manager, delay=3.0):
-        """Aguarda um delay e então limpa a sessão completamente."""
-        await asyncio.sleep(delay)
-        session = session_manager.get_session(call_id)
-        if session:
+        """Aguarda um delay e então limpa a sessão completamente (cancelável por um hangup posterior)."""
+        try:
+            await asyncio.sleep(delay)
+            session = session_manager.get_session(call_id)
+            if not session:
+                return
             # Sinalizar encerramento e depois forçar remoção
             session_manager.end_session(call_id)
             await asyncio.sleep(1.0)
-            session_manager._complete_session_termination(call_id)
-            logger.info(f"Sessão {call_id} encerrada após KIND_HANGUP")
+        except asyncio.CancelledError:
+            return
+        session_manager._complete_session_termination(call_id)
+        logger.info(f"Sessão {call_id} encerrada após KIND_HANGUP")
+    
+    def _forget_cleanup(self, call_id, task):
+        """Remove a limpeza concluída do registro, salvo se já foi substituída por outra."""
+        if self._pending_cleanups.get(call_id) is task:
+            del self._pending_cleanups[call_id]
     
     async def start(self, host: str = '0.0.0.0', port: int = 8082):
         """
@@ -1,9 +1,26 @@
+import asyncio
+import hashlib
 import json
 import os
 import logging
+import tempfile
+import threading
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
+
+def _hash_configs(configs) -> bytes:
+    """Hash do conteúdo canônico (chaves ordenadas) das configurações."""
+    if orjson is not None:
+        canonical = orjson.dumps(configs, option=orjson.OPT_SORT_KEYS)
+    else:
+        canonical = json.dumps(configs, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return hashlib.blake2b(canonical, digest_size=16).digest()
+
 class ConfigPersistence:
     """
     Classe responsável por persistir configurações de ramais localmente,
@@ -15,6 +32,21 @@ class ConfigPersistence:
         self.config_path = config_path
         # Garante que o diretório existe
         os.makedirs(os.path.dirname(self.config_path), exist_ok=True)
+        # Hash do último conteúdo salvo/carregado e (mtime_ns, tamanho) do arquivo naquele
+        # momento: só se pula a escrita se o arquivo continua exatamente como ficou
+        # (uma edição manual muda o mtime e força a regravação)
+        self._last_hash = None
+        self._last_stat = None
+        # Gravações vêm de várias threads do executor (API, flush, refresh): uma de cada vez
+        self._write_lock = threading.Lock()
+    
+    def _file_stat(self):
+        """(mtime_ns, tamanho) do arquivo de configuração, ou None se não existir."""
+        try:
+            st = os.stat(self.config_path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
     
     def save_configs(self, configs):
         """
@@ -24,14 +56,55 @@ class ConfigPersistence:
             configs (list): Lista de dicionários com configurações de ramais
         """
         try:
-            with open(self.config_path, 'w') as f:
-                json.dump({'ramais': configs}, f, indent=2)
+            config_hash = _hash_configs(configs)
+            
+            if orjson is not None:
+                data = orjson.dumps({'ramais': configs}, option=orjson.OPT_INDENT_2)
+            else:
+                data = json.dumps({'ramais': configs}, indent=2).encode('utf-8')
+            
+            # Escreve num arquivo temporário exclusivo e troca atomicamente: uma queda no meio
+            # da escrita nunca deixa o arquivo de configuração truncado
+            with self._write_lock:
+                if (config_hash == self._last_hash and self._last_stat is not None
+                        and self._file_stat() == self._last_stat):
+                    logger.debug(f"Configurações de {len(configs)} ramais inalteradas, arquivo não reescrito")
+                    return True
+                
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.config_path) or '.',
+                                                suffix='.tmp')
+                try:
+                    with os.fdopen(fd, 'wb') as f:
+                        f.write(data)
+                    # mkstemp cria com 0600; manter as permissões usuais do arquivo de configuração
+                    os.chmod(tmp_path, 0o644)
+                    os.replace(tmp_path, self.config_path)
+                except BaseException:
+                    try:
+                        os.unlink(tmp_path)
+                    except OSError:
+                        pass
+                    raise
+                self._last_hash = config_hash
+                self._last_stat = self._file_stat()
             logger.info(f"Configurações de {len(configs)} ramais salvas em {self.config_path}")
             return True
         except Exception as e:
             logger.error(f"Erro ao salvar configurações localmente: {e}")
             return False
     
+    async def save_configs_async(self, configs):
+        """
+        Versão assíncrona de save_configs para uso em handlers do aiohttp:
+        a serialização e a escrita em disco rodam no executor padrão, sem
+        bloquear o loop de eventos.
+        
+        Args:
+            configs (list): Lista de dicionários com configurações de ramais
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.save_configs, configs)
+    
     def load_configs(self):
         """
         Carrega configurações de ramais a partir do arquivo JSON local.
@@ -44,11 +117,19 @@ class ConfigPersistence:
             return []
         
         try:
-            with open(self.config_path, 'r') as f:
-                data = json.load(f)
-                configs = data.get('ramais', [])
-                logger.info(f"Carregadas {len(configs)} configurações de ramais do arquivo local")
-                return configs
+            with self._write_lock:
+                file_stat = self._file_stat()
+                with open(self.config_path, 'rb') as f:
+                    raw = f.read()
+            data = orjson.loads(raw) if orjson is not None else json.loads(raw)
+            configs = data.get('ramais', [])
+            # O primeiro refresh com o mesmo conteúdo do disco não precisa reescrever o arquivo
+            config_hash = _hash_configs(configs)
+            with self._write_lock:
+                self._last_hash = config_hash
+                self._last_stat = file_stat
+            logger.info(f"Carregadas {len(configs)} configurações de ramais do arquivo local")
+            return configs
         except Exception as e:
             logger.error(f"Erro ao carregar configurações locais: {e}")
             return []
\ No newline at end of file
@@ -1,102 +1,162 @@
-import os
 import logging
+import threading
+from contextlib import contextmanager
+
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from dotenv import load_dotenv
+import psycopg2.extras
+from psycopg2.pool import ThreadedConnectionPool
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from ._db_env import _db_config
 
-load_dotenv()
 logger = logging.getLogger(__name__)
 
+# Colunas json/jsonb decodificadas com orjson (registro global, feito uma vez na importação)
+if orjson is not None:
+    psycopg2.extras.register_default_json(globally=True, loads=orjson.loads)
+    psycopg2.extras.register_default_jsonb(globally=True, loads=orjson.loads)
+
+# Tamanho do pool: consultas pontuais (inicialização, refresh, API), chamadas também de threads do executor
+DB_POOL_MIN_SIZE = 1
+DB_POOL_MAX_SIZE = 4
+# As conexões do pool servem só a consultas; LISTEN fica na conexão dedicada do PostgresListener
+DB_POOL_APPLICATION_NAME = "ext_ia_query"
+
+# Consultas das configurações de ramais; o TRIM das colunas de texto é feito em Python e
+# as portas (texto no banco) já chegam como int, com vazio/NULL virando NULL
+_EXT_SELECT_SQL = (
+    "SELECT extension_ia_id, extension_ia_number, extension_ia_return, extension_ia_ip, "
+    "NULLIF(BTRIM(extension_ia_number_port), '')::int, condominium_id, "
+    "NULLIF(BTRIM(extension_ia_return_port), '')::int "
+    "FROM public.extension_ia"
+)
+_GET_EXT_SQL = _EXT_SELECT_SQL + " ORDER BY extension_ia_id"
+_GET_EXT_BY_ID_SQL = _EXT_SELECT_SQL + " WHERE extension_ia_id = %s"
+
+
+def _row_to_config(ext_id, numero, retorno, ip, porta_ia, condominio_id, porta_retorno):
+    """Converte uma linha de extension_ia (colunas na ordem de _EXT_SELECT_SQL) para o formato de configuração."""
+    return {
+        'id': ext_id,
+        'ramal_ia': (numero or '').strip(),
+        'ramal_retorno': (retorno or '').strip(),
+        'ip_servidor': (ip or '').strip(),
+        'porta_ia': porta_ia or 0,
+        'porta_retorno': porta_retorno or 0,
+        'condominio_id': condominio_id,
+    }
+
+
 class DBConnector:
     def __init__(self):
-        self.conn = None
-        self.db_config = {
-            'dbname': os.getenv('DB_NAME', 'postgres'),
-            'user': os.getenv('DB_USER', 'admincd'),
-            'password': os.getenv('DB_PASSWORD', 'Isabela@2022!!'),
-            'host': os.getenv('DB_HOST', 'dev-postgres-cd.postgres.database.azure.com'),
-            'port': os.getenv('DB_PORT', '5432'),
-        }
+        self.pool = None
+        # getconn() do psycopg2 não espera: com o pool cheio levanta PoolError. O semáforo
+        # faz quem chega a mais (threads do executor) aguardar uma conexão ser devolvida.
+        self._pool_slots = threading.BoundedSemaphore(DB_POOL_MAX_SIZE)
+        self._pool_lock = threading.Lock()
+        self.db_config = _db_config()
     
     def connect(self):
-        """Estabelece conexão com o banco de dados PostgreSQL."""
+        """
+        Cria o pool de conexões com o banco de dados PostgreSQL.
+        Idempotente: com o pool já criado, retorna True sem abrir novas conexões.
+        """
+        with self._pool_lock:
+            return self._create_pool()
+    
+    def _create_pool(self):
+        if self.pool is not None and not self.pool.closed:
+            return True
         try:
-            self.conn = psycopg2.connect(**self.db_config)
-            logger.info("Conexão com banco de dados PostgreSQL estabelecida com sucesso.")
+            self.pool = ThreadedConnectionPool(
+                DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE,
+                application_name=DB_POOL_APPLICATION_NAME, **self.db_config
+            )
+            logger.info("Pool de conexões com banco de dados PostgreSQL criado com sucesso.")
             return True
         except Exception as e:
             logger.error(f"Erro ao conectar ao banco de dados: {e}")
+            self.pool = None
             return False
     
     def disconnect(self):
-        """Encerra a conexão com o banco de dados."""
-        if self.conn:
-            self.conn.close()
-            self.conn = None
-            logger.info("Conexão com banco de dados PostgreSQL encerrada.")
+        """Encerra todas as conexões do pool."""
+        if self.pool is not None:
+            self.pool.closeall()
+            self.pool = None
+            logger.info("Conexões com banco de dados PostgreSQL encerradas.")
+    
+    @contextmanager
+    def _connection(self):
+        """
+        Empresta uma conexão do pool (esperando se todas estiverem em uso) e a devolve ao final; conexões que
+        falharam no nível de rede são descartadas em vez de reaproveitadas.
+        """
+        with self._pool_slots:
+            pool = self.pool
+            conn = pool.getconn()
+            broken = False
+            try:
+                yield conn
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                broken = True
+                raise
+            finally:
+                pool.putconn(conn, close=broken or bool(conn.closed))
     
     def get_extensions(self):
         """
         Obtém todas as configurações de ramais da IA da tabela extension_ia.
         Retorna uma lista de dicionários com as configurações.
         """
-        if not self.conn:
-            if not self.connect():
-                logger.error("Não foi possível conectar ao banco de dados para obter extensões.")
-                return []
+        if not self.connect():
+            logger.error("Não foi possível conectar ao banco de dados para obter extensões.")
+            return []
         
         try:
-            cursor = self.conn.cursor(cursor_factory=RealDictCursor)
-            query = """
-                SELECT 
-                    extension_ia_id,
-                    TRIM(extension_ia_number) as extension_ia_number,
-                    TRIM(extension_ia_return) as extension_ia_return,
-                    TRIM(extension_ia_ip) as extension_ia_ip,
-                    TRIM(extension_ia_number_port) as extension_ia_number_port,
-                    condominium_id,
-                    TRIM(extension_ia_return_port) as extension_ia_return_port
-                FROM 
-                    public.extension_ia
-                ORDER BY 
-                    extension_ia_id
-            """
-            cursor.execute(query)
-            extensions = cursor.fetchall()
+            with self._connection() as conn, conn.cursor() as cursor:
+                cursor.execute(_GET_EXT_SQL)
+                rows = cursor.fetchall()
             
             # Converter para formato mais amigável
-            result = []
-            for ext in extensions:
-                result.append({
-                    'id': ext['extension_ia_id'],
-                    'ramal_ia': ext['extension_ia_number'],
-                    'ramal_retorno': ext['extension_ia_return'],
-                    'ip_servidor': ext['extension_ia_ip'],
-                    'porta_ia': int(ext['extension_ia_number_port']),
-                    'porta_retorno': int(ext['extension_ia_return_port'] or 0),
-                    'condominio_id': ext['condominium_id']
-                })
+            result = [_row_to_config(*row) for row in rows]
             
             logger.info(f"Obtidas {len(result)} configurações de ramais do banco de dados.")
             return result
         except Exception as e:
             logger.error(f"Erro ao obter extensões do banco de dados: {e}")
             return []
-        finally:
-            if cursor:
-                cursor.close()
+    
+    def get_extension(self, extension_id):
+        """
+        Obtém a configuração de um único ramal da IA pelo extension_ia_id.
+        Retorna None se o ramal não existir ou se a consulta falhar.
+        """
+        if not self.connect():
+            logger.error("Não foi possível conectar ao banco de dados para obter a extensão.")
+            return None
+        
+        try:
+            with self._connection() as conn, conn.cursor() as cursor:
+                cursor.execute(_GET_EXT_BY_ID_SQL, (extension_id,))
+                row = cursor.fetchone()
+            return _row_to_config(*row) if row else None
+        except Exception as e:
+            logger.error(f"Erro ao obter extensão ID {extension_id} do banco de dados: {e}")
+            return None
     
     def test_connection(self):
         """Testa a conexão com o banco de dados."""
-        if not self.conn:
-            return self.connect()
+        if not self.connect():
+            return False
         
         try:
-            cursor = self.conn.cursor()
-            cursor.execute("SELECT 1")
-            cursor.close()
+            with self._connection() as conn, conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
             return True
         except Exception as e:
             logger.error(f"Erro ao testar conexão com banco de dados: {e}")
-            self.conn = None
             return False
\ No newline at end of file
@@ -1,20 +1,35 @@
 import asyncio
 import json
 import logging
+import random
 import psycopg2
 import psycopg2.extensions
-import select
 from typing import Callable, Dict, Any
-from dotenv import load_dotenv
-import os
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from ._db_env import _db_config
 
-load_dotenv()
 logger = logging.getLogger(__name__)
 
+# application_name da conexão do listener, para identificá-la em pg_stat_activity
+LISTENER_APPLICATION_NAME = "ext_ia_listener"
+
+# orjson aceita o payload (str) diretamente; orjson.JSONDecodeError herda de json.JSONDecodeError
+_loads = orjson.loads if orjson is not None else json.loads
+
+# Reconexão: backoff exponencial (base * 2^tentativa, limitado) com jitter de ±50%
+RECONNECT_BACKOFF_BASE = 5.0
+RECONNECT_BACKOFF_CAP = 60.0
+RECONNECT_MAX_ATTEMPTS = 0  # 0 = tentar indefinidamente
+
 class PostgresListener:
     """
     Classe que implementa um listener assíncrono para notificações do PostgreSQL.
-    Usa asyncio para não bloquear a aplicação principal.
+    O socket da conexão é registrado no event loop (add_reader), que avisa quando
+    há notificações a ler, sem polling nem select bloqueante.
     """
     
     def __init__(self, callback: Callable[[dict], None], channel: str = "change_record_extension_ia"):
@@ -30,13 +45,10 @@ class PostgresListener:
         self.conn = None
         self.running = False
         self.task = None
-        self.db_config = {
-            'dbname': os.getenv('DB_NAME', 'postgres'),
-            'user': os.getenv('DB_USER', 'admincd'),
-            'password': os.getenv('DB_PASSWORD', 'Isabela@2022!!'),
-            'host': os.getenv('DB_HOST', 'dev-postgres-cd.postgres.database.azure.com'),
-            'port': os.getenv('DB_PORT', '5432'),
-        }
+        self._loop = None
+        self._fd = None
+        self._dispatch_tasks = set()
+        self.db_config = _db_config()
     
     async def connect(self) -> bool:
         """
@@ -46,14 +58,10 @@ class PostgresListener:
             bool: True se a conexão foi estabelecida com sucesso
         """
         try:
-            # Use psycopg2 diretamente, já que não tem versão assíncrona nativa
-            self.conn = psycopg2.connect(**self.db_config)
-            self.conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
-            
-            # Registrar no canal
-            cursor = self.conn.cursor()
-            cursor.execute(f"LISTEN {self.channel};")
-            cursor.close()
+            # psycopg2 não tem API assíncrona: o handshake (TCP/TLS/autenticação) e o
+            # LISTEN rodam no executor para não travar o event loop, inclusive na reconexão
+            loop = asyncio.get_running_loop()
+            self.conn = await loop.run_in_executor(None, self._open_listen_connection)
             
             logger.info(f"Listener conectado ao banco de dados e escutando no canal '{self.channel}'")
             return True
@@ -61,9 +69,21 @@ class PostgresListener:
             logger.error(f"Erro ao conectar listener ao banco de dados: {e}")
             return False
     
+    def _open_listen_connection(self):
+        # Conexão própria e de longa duração, fora do pool do DBConnector: LISTEN é estado
+        # de sessão e se perde se a conexão for reaproveitada (ou com pgbouncer em modo transaction)
+        conn = psycopg2.connect(application_name=LISTENER_APPLICATION_NAME, **self.db_config)
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        
+        # Registrar no canal
+        with conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {self.channel};")
+        return conn
+    
     async def listen(self):
         """
-        Inicia o loop de escuta de notificações de forma não-bloqueante.
+        Conecta (se necessário) e registra o socket da conexão no event loop.
+        As notificações passam a ser tratadas em _on_readable.
         """
         if not self.conn:
             success = await self.connect()
@@ -72,47 +92,91 @@ class PostgresListener:
                 return
         
         self.running = True
+        self._add_reader()
         logger.info(f"Listener iniciado no canal '{self.channel}'")
+    
+    def _add_reader(self):
+        self._loop = asyncio.get_running_loop()
+        self._fd = self.conn.fileno()
+        self._loop.add_reader(self._fd, self._on_readable)
+    
+    def _remove_reader(self):
+        if self._loop is not None and self._fd is not None:
+            self._loop.remove_reader(self._fd)
+        self._fd = None
+    
+    def _on_readable(self):
+        """
+        Chamado pelo event loop quando o socket da conexão tem dados: lê as
+        notificações pendentes e despacha o lote para o callback.
+        """
+        try:
+            self.conn.poll()
+        except psycopg2.OperationalError:
+            logger.error("Conexão com o banco de dados perdida. Tentando reconectar...")
+            self._remove_reader()
+            self.conn.close()
+            self.conn = None
+            self.task = self._loop.create_task(self._reconnect())
+            return
         
-        while self.running:
+        # Esvaziar a lista de uma vez (pop(0) desloca a lista inteira a cada item)
+        notifies = self.conn.notifies
+        pending = notifies[:]
+        notifies.clear()
+        
+        payloads = []
+        for notify in pending:
+            # Cada notificação isolada: um payload ruim não pode derrubar o resto do lote
+            # (a lista do psycopg2 já foi esvaziada acima)
             try:
-                # Verifica se há notificações disponíveis, com timeout para não bloquear
-                if select.select([self.conn], [], [], 1) == ([self.conn], [], []):
-                    self.conn.poll()
-                    
-                    # Processa todas as notificações pendentes
-                    while self.conn.notifies:
-                        notify = self.conn.notifies.pop(0)
-                        try:
-                            payload = json.loads(notify.payload)
-                            logger.info(f"Notificação recebida: {payload['action']} na extensão")
-                            logger.debug(f"Payload completo: {payload}")
-                            
-                            # Chama o callback com os dados recebidos
-                            await self.callback(payload)
-                        except json.JSONDecodeError:
-                            logger.error(f"Payload inválido recebido: {notify.payload}")
-                        except Exception as e:
-                            logger.error(f"Erro ao processar notificação: {e}", exc_info=True)
-                
-                # Dá chance para outras tarefas assíncronas executarem
-                await asyncio.sleep(0.1)
-                
-            except psycopg2.OperationalError:
-                logger.error("Conexão com o banco de dados perdida. Tentando reconectar...")
-                self.conn.close()
-                self.conn = None
-                
-                # Tenta reconectar
-                await asyncio.sleep(5)  # Espera 5 segundos antes de tentar novamente
-                success = await self.connect()
-                if not success:
-                    logger.error("Falha ao reconectar. Tentando novamente em 10 segundos...")
-                    await asyncio.sleep(10)
-            
+                payload = _loads(notify.payload)
+                if not isinstance(payload, dict):
+                    logger.error("Payload inválido recebido: %s", notify.payload)
+                    continue
+                logger.info("Notificação recebida: %s na extensão", payload.get('action'))
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Payload completo: %r", payload)
+                payloads.append(payload)
+            except json.JSONDecodeError:
+                logger.error("Payload inválido recebido: %s", notify.payload)
+            except Exception as e:
+                logger.error("Erro ao processar notificação: %s", e, exc_info=True)
+        
+        if payloads:
+            # Um lote por task, processado em ordem, para preservar a sequência das notificações
+            task = self._loop.create_task(self._dispatch(payloads))
+            self._dispatch_tasks.add(task)
+            task.add_done_callback(self._dispatch_tasks.discard)
+    
+    async def _dispatch(self, payloads):
+        for payload in payloads:
+            try:
+                await self.callback(payload)
             except Exception as e:
-                logger.error(f"Erro no loop do listener: {e}")
-                await asyncio.sleep(5)  # Pequena pausa para evitar loop de erro intensivo
+                logger.error("Erro ao processar notificação: %s", e, exc_info=True)
+    
+    async def _reconnect(self):
+        """
+        Tenta reconectar com backoff exponencial e jitter, para que várias instâncias
+        não reconectem em sincronia após uma queda do banco.
+        """
+        attempt = 0
+        while self.running:
+            delay = min(RECONNECT_BACKOFF_CAP, RECONNECT_BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.5)
+            await asyncio.sleep(delay)
+            if not self.running:
+                return
+            if await self.connect():
+                self._add_reader()
+                return
+            
+            attempt += 1
+            if RECONNECT_MAX_ATTEMPTS and attempt >= RECONNECT_MAX_ATTEMPTS:
+                logger.error(f"Falha ao reconectar após {attempt} tentativas. Listener encerrado.")
+                self.running = False
+                return
+            logger.error(f"Falha ao reconectar (tentativa {attempt}). Tentando novamente com backoff...")
     
     async def start(self):
         """
@@ -131,6 +195,7 @@ class PostgresListener:
         Para o listener e libera os recursos.
         """
         self.running = False
+        self._remove_reader()
         
         if self.task:
             self.task.cancel()
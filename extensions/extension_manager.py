@@ -11,6 +11,24 @@ from .db_listener import PostgresListener
 
 logger = logging.getLogger(__name__)
 
+# Janela (s) para juntar notificações de uma mesma rajada antes de aplicá-las
+NOTIFICATION_COALESCE_WINDOW = 0.05
+
+# Atraso (s) para gravar o arquivo de configurações após a última alteração
+CONFIG_FLUSH_DELAY = 0.5
+
+def _payload_to_config(extension_id, data: Dict[str, Any]) -> Dict[str, Any]:
+    """Converte a linha enviada em 'data' na notificação para o formato usado pelo ServerManager."""
+    return {
+        'id': extension_id,
+        'ramal_ia': data.get('extension_ia_number', '').strip(),
+        'ramal_retorno': data.get('extension_ia_return', '').strip(),
+        'ip_servidor': data.get('extension_ia_ip', '').strip(),
+        'porta_ia': int(data.get('extension_ia_number_port', 0)),
+        'porta_retorno': int(data.get('extension_ia_return_port', 0)),
+        'condominio_id': data.get('condominium_id', 0)
+    }
+
 class ExtensionManager:
     """
     Classe principal que gerencia todo o sistema de extensões da IA.
@@ -24,132 +42,220 @@ class ExtensionManager:
         self.api_server = APIServer(
             self.server_manager,
             self.config_persistence,
-            self.db_connector
+            self.db_connector,
+            refresh_handler=self.refresh_configurations
         )
         self.db_listener = PostgresListener(self.handle_db_notification)
+        self._notification_queue = asyncio.Queue()
+        self._notification_task = None
+        # Configurações canônicas em memória (id -> config); o arquivo local é só o espelho
+        self._configs_by_id: Dict[Any, Dict[str, Any]] = {}
+        self._flush_task = None
+        # Gravação da flush em andamento na thread do executor (não é interrompida por cancel)
+        self._flush_save = None
+        # Tratador de cada ação de notificação
+        self._handlers = {
+            'INSERT': self._on_insert,
+            'UPDATE': self._on_update,
+            'DELETE': self._on_delete,
+        }
         self.is_running = False
         self.api_runner = None
         self.api_site = None
     
     async def handle_db_notification(self, payload: Dict[str, Any]):
         """
-        Processa notificações recebidas do banco de dados e realiza as ações necessárias.
+        Recebe uma notificação do banco de dados e a enfileira; as notificações
+        são aplicadas em lote por _apply_loop.
         
         Args:
             payload: Dicionário contendo os dados da notificação
         """
-        try:
+        self._notification_queue.put_nowait(payload)
+        if self._notification_task is None or self._notification_task.done():
+            self._notification_task = asyncio.create_task(self._apply_loop())
+    
+    async def _apply_loop(self):
+        """
+        Aguarda notificações e, a cada rajada, espera NOTIFICATION_COALESCE_WINDOW
+        para juntar as que chegarem em seguida e aplicá-las de uma vez.
+        """
+        queue = self._notification_queue
+        while True:
+            batch = [await queue.get()]
+            await asyncio.sleep(NOTIFICATION_COALESCE_WINDOW)
+            while not queue.empty():
+                batch.append(queue.get_nowait())
+            
+            try:
+                await self._apply_notifications(batch)
+            except Exception as e:
+                logger.error("Erro ao processar notificação do banco de dados: %s", e)
+    
+    async def _apply_notifications(self, batch: List[Dict[str, Any]]):
+        """
+        Aplica um lote de notificações: só a última ação de cada extensão vale,
+        as extensões são tratadas em paralelo e as configurações locais são
+        atualizadas em memória, com gravação do arquivo agendada.
+        """
+        changes = {}
+        for payload in batch:
             action = payload.get('action', '').upper()  # Converter para maiúsculo para padronização
             data = payload.get('data', {})
-            
-            logger.info(f"Processando notificação: {action} para extensão")
-            
-            if action == 'INSERT':
-                # Nova extensão foi adicionada
-                logger.info(f"Nova extensão detectada: {data.get('extension_ia_number')}")
-                
-                # Converter para o formato usado pelo ServerManager
-                config = {
-                    'id': data.get('extension_ia_id'),
-                    'ramal_ia': data.get('extension_ia_number', '').strip(),
-                    'ramal_retorno': data.get('extension_ia_return', '').strip(),
-                    'ip_servidor': data.get('extension_ia_ip', '').strip(),
-                    'porta_ia': int(data.get('extension_ia_number_port', 0)),
-                    'porta_retorno': int(data.get('extension_ia_return_port', 0)),
-                    'condominio_id': data.get('condominium_id', 0)
-                }
-                
-                # Iniciar novo servidor para esta extensão
-                try:
-                    await self.server_manager.start_server(config)
-                    logger.info(f"Servidor para nova extensão {config['ramal_ia']} iniciado com sucesso")
-                    
-                    # Atualizar configurações locais
-                    configs = self.config_persistence.load_configs()
-                    configs.append(config)
-                    self.config_persistence.save_configs(configs)
-                except Exception as e:
-                    logger.error(f"Erro ao iniciar servidor para nova extensão: {e}")
-                    # Porta pode estar em uso ou outro erro, não adicionamos o ramal
-                
-            elif action == 'UPDATE':
-                # Extensão foi atualizada
-                extension_id = data.get('extension_ia_id')
-                logger.info(f"Atualização de extensão detectada: ID {extension_id}")
-                
-                # Converter para o formato usado pelo ServerManager
-                config = {
-                    'id': extension_id,
-                    'ramal_ia': data.get('extension_ia_number', '').strip(),
-                    'ramal_retorno': data.get('extension_ia_return', '').strip(),
-                    'ip_servidor': data.get('extension_ia_ip', '').strip(),
-                    'porta_ia': int(data.get('extension_ia_number_port', 0)),
-                    'porta_retorno': int(data.get('extension_ia_return_port', 0)),
-                    'condominio_id': data.get('condominium_id', 0)
-                }
-                
-                # Verificar se já temos esta extensão
-                if extension_id in self.server_manager.servers:
-                    # Parar o servidor atual
-                    await self.server_manager.stop_server(extension_id)
-                    
-                    try:
-                        # Iniciar com a nova configuração
-                        await self.server_manager.start_server(config)
-                        logger.info(f"Servidor para extensão {config['ramal_ia']} reiniciado com nova configuração")
-                        
-                        # Atualizar configurações locais
-                        configs = self.config_persistence.load_configs()
-                        for i, existing_config in enumerate(configs):
-                            if existing_config.get('id') == extension_id:
-                                configs[i] = config
-                                break
-                        self.config_persistence.save_configs(configs)
-                    except Exception as e:
-                        logger.error(f"Erro ao reiniciar servidor para extensão ID {extension_id}: {e}")
-                        logger.warning(f"A extensão ID {extension_id} foi removida devido à falha na atualização")
-                        
-                        # Remover das configurações locais já que não conseguimos subir o socket
-                        configs = self.config_persistence.load_configs()
-                        configs = [c for c in configs if c.get('id') != extension_id]
-                        self.config_persistence.save_configs(configs)
-                else:
-                    # Extensão não existe, tratar como INSERT
-                    try:
-                        await self.server_manager.start_server(config)
-                        logger.info(f"Servidor para extensão atualizada {config['ramal_ia']} iniciado")
-                        
-                        # Atualizar configurações locais
-                        configs = self.config_persistence.load_configs()
-                        configs.append(config)
-                        self.config_persistence.save_configs(configs)
-                    except Exception as e:
-                        logger.error(f"Erro ao iniciar servidor para extensão atualizada ID {extension_id}: {e}")
-                        # Não persistimos a configuração se falhar ao iniciar o servidor
-                
-            elif action == 'DELETE':
-                # Extensão foi removida
-                extension_id = data.get('extension_ia_id')
-                logger.info(f"Remoção de extensão detectada: ID {extension_id}")
-                
-                # Verificar se temos esta extensão
-                if extension_id in self.server_manager.servers:
-                    # Parar o servidor
-                    await self.server_manager.stop_server(extension_id)
-                    logger.info(f"Servidor para extensão ID {extension_id} removido com sucesso")
-                    
-                    # Atualizar configurações locais
-                    configs = self.config_persistence.load_configs()
-                    configs = [c for c in configs if c.get('id') != extension_id]
-                    self.config_persistence.save_configs(configs)
-                else:
-                    logger.warning(f"Tentativa de remover extensão ID {extension_id} que não está ativa")
-            
+            if action not in self._handlers:
+                logger.warning("Ação desconhecida recebida: %s", action)
+                continue
+            # Payload do trigger notify_ext_ia traz só o id; o formato antigo traz a linha em 'data'
+            extension_id = payload['id'] if 'id' in payload else data.get('extension_ia_id')
+            changes.pop(extension_id, None)
+            changes[extension_id] = (action, data)
+        
+        if not changes:
+            return
+        
+        logger.info("Processando %s notificação(ões) para %s extensão(ões)", len(batch), len(changes))
+        
+        results = await asyncio.gather(
+            *(self._apply_change(extension_id, action, data)
+              for extension_id, (action, data) in changes.items()),
+            return_exceptions=True
+        )
+        
+        # id -> nova configuração, ou None para remover das configurações locais
+        updates = {}
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error("Erro ao processar notificação do banco de dados: %s", result)
+            elif result is not None:
+                extension_id, config = result
+                updates[extension_id] = config
+        
+        if not updates:
+            return
+        
+        # Atualizar configurações locais
+        for extension_id, config in updates.items():
+            if config is None:
+                self._configs_by_id.pop(extension_id, None)
             else:
-                logger.warning(f"Ação desconhecida recebida: {action}")
+                self._configs_by_id[extension_id] = config
+        self._schedule_flush()
+    
+    def _schedule_flush(self):
+        """Agenda a gravação das configurações, reiniciando a espera a cada nova alteração."""
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        self._flush_task = asyncio.create_task(self._flush_after_delay())
+    
+    async def _flush_after_delay(self):
+        await asyncio.sleep(CONFIG_FLUSH_DELAY)
+        # shield: cancelar a task não impede a thread de gravar, então a gravação fica
+        # registrada em _flush_save para quem precisar esperar por ela (_drain_flush)
+        self._flush_save = asyncio.ensure_future(
+            self.config_persistence.save_configs_async(list(self._configs_by_id.values()))
+        )
+        await asyncio.shield(self._flush_save)
+    
+    async def _drain_flush(self) -> bool:
+        """
+        Cancela a gravação agendada e, se uma já estiver em andamento, espera que termine,
+        para que ela não sobrescreva uma gravação feita em seguida.
+        
+        Returns:
+            bool: True se havia uma gravação agendada que ainda não tinha começado
+        """
+        task, self._flush_task = self._flush_task, None
+        pending = False
+        if task is not None and not task.done():
+            pending = self._flush_save is None or self._flush_save.done()
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        save, self._flush_save = self._flush_save, None
+        if save is not None:
+            await save
+        return pending
+    
+    async def _apply_change(self, extension_id, action: str, data: Dict[str, Any]):
+        """
+        Aplica a ação de uma notificação sob o lock da extensão (o mesmo usado por
+        /api/restart e pelo refresh); outras extensões seguem em paralelo.
+        
+        Returns:
+            (id, config) para gravar a configuração, (id, None) para removê-la
+            das configurações locais, ou None se nada muda localmente
+        """
+        async with self.server_manager.extension_lock(extension_id):
+            result = await self._handlers[action](extension_id, data)
+        
+        # Extensão removida: descartar o lock se ninguém mais o aguarda
+        if action == 'DELETE':
+            self.server_manager.discard_extension_lock(extension_id)
+        return result
+    
+    async def _on_insert(self, extension_id, data: Dict[str, Any]):
+        logger.info("Nova extensão detectada: ID %s", extension_id)
+        return await self._upsert_extension(extension_id, data)
+    
+    async def _on_update(self, extension_id, data: Dict[str, Any]):
+        logger.info("Atualização de extensão detectada: ID %s", extension_id)
+        return await self._upsert_extension(extension_id, data)
+    
+    async def _on_delete(self, extension_id, data: Dict[str, Any]):
+        logger.info("Remoção de extensão detectada: ID %s", extension_id)
         
+        if extension_id not in self.server_manager.servers:
+            logger.warning("Tentativa de remover extensão ID %s que não está ativa", extension_id)
+            return None
+        
+        await self.server_manager.stop_server(extension_id)
+        logger.info("Servidor para extensão ID %s removido com sucesso", extension_id)
+        return extension_id, None
+    
+    async def _upsert_extension(self, extension_id, data: Dict[str, Any]):
+        """
+        Inicia (ou reinicia) os servidores da extensão com a configuração da notificação.
+        
+        Returns:
+            (id, config) para gravar a configuração, (id, None) para removê-la
+            das configurações locais, ou None se nada muda localmente
+        """
+        if data:
+            config = _payload_to_config(extension_id, data)
+        else:
+            # Payload mínimo: buscar a linha atual no banco
+            loop = asyncio.get_running_loop()
+            config = await loop.run_in_executor(None, self.db_connector.get_extension, extension_id)
+            if config is None:
+                logger.warning("Extensão ID %s não encontrada no banco; notificação ignorada", extension_id)
+                return None
+        
+        # Verificar se já temos esta extensão (ex.: DELETE + INSERT coalescidos)
+        if extension_id in self.server_manager.servers:
+            # Parar o servidor atual
+            await self.server_manager.stop_server(extension_id)
+            
+            try:
+                # Iniciar com a nova configuração
+                await self.server_manager.start_server(config)
+                logger.info("Servidor para extensão %s reiniciado com nova configuração", config['ramal_ia'])
+                return extension_id, config
+            except Exception as e:
+                logger.error("Erro ao reiniciar servidor para extensão ID %s: %s", extension_id, e)
+                logger.warning("A extensão ID %s foi removida devido à falha na atualização", extension_id)
+                # Remover das configurações locais já que não conseguimos subir o socket
+                return extension_id, None
+        
+        try:
+            await self.server_manager.start_server(config)
+            logger.info("Servidor para extensão %s iniciado com sucesso", config['ramal_ia'])
+            return extension_id, config
         except Exception as e:
-            logger.error(f"Erro ao processar notificação do banco de dados: {e}")
+            logger.error("Erro ao iniciar servidor para extensão ID %s: %s", extension_id, e)
+            # Porta pode estar em uso ou outro erro: não persistimos a configuração
+            return None
 
     async def initialize(self, api_port: int = 8082) -> bool:
         """
@@ -164,6 +270,7 @@ class ExtensionManager:
         try:
             # Carregar configurações (do banco ou local)
             configs = self._load_configurations()
+            self._configs_by_id = {config.get('id'): config for config in configs}
             
             if not configs:
                 logger.warning("Nenhuma configuração de extensão encontrada. Usando configuração padrão.")
@@ -217,24 +324,35 @@ class ExtensionManager:
         logger.info("Não foi possível obter configurações do banco, tentando arquivo local")
         return self.config_persistence.load_configs()
     
-    async def refresh_configurations(self) -> Tuple[int, int, int]:
+    async def refresh_configurations(self, configs: Optional[List[Dict[str, Any]]] = None) -> Tuple[int, int, int]:
         """
         Atualiza as configurações de ramais a partir do banco de dados.
         
+        Args:
+            configs: Configurações já lidas do banco (ex.: pela API); se omitido, consulta o banco
+        
         Returns:
             Tuple[int, int, int]: Contadores de (removidos, atualizados, adicionados)
         """
-        if self.db_connector.connect():
-            configs = self.db_connector.get_extensions()
-            
-            if configs:
-                # Persistir configurações localmente
-                self.config_persistence.save_configs(configs)
-                
-                # Atualizar servidores
-                return await self.server_manager.restart_servers(configs)
+        if configs is None:
+            loop = asyncio.get_running_loop()
+            if not await loop.run_in_executor(None, self.db_connector.connect):
+                return 0, 0, 0
+            configs = await loop.run_in_executor(None, self.db_connector.get_extensions)
+        
+        if not configs:
+            return 0, 0, 0
+        
+        # As configurações do banco substituem as em memória; uma flush pendente
+        # (com o conjunto antigo) não pode gravar por cima delas
+        await self._drain_flush()
+        self._configs_by_id = {config.get('id'): config for config in configs}
+        
+        # Persistir configurações localmente
+        await self.config_persistence.save_configs_async(configs)
         
-        return 0, 0, 0
+        # Atualizar servidores: só os ramais novos, removidos ou alterados
+        return await self.server_manager.restart_servers(configs)
     
     async def shutdown(self) -> bool:
         """
@@ -248,6 +366,18 @@ class ExtensionManager:
             await self.db_listener.stop()
             logger.info("Listener de banco de dados encerrado")
             
+            if self._notification_task:
+                self._notification_task.cancel()
+                try:
+                    await self._notification_task
+                except asyncio.CancelledError:
+                    pass
+                self._notification_task = None
+            
+            # Gravar alterações de configuração ainda pendentes
+            if await self._drain_flush():
+                self.config_persistence.save_configs(list(self._configs_by_id.values()))
+            
             # Parar todos os servidores
             for extension_id in list(self.server_manager.servers.keys()):
                 await self.server_manager.stop_server(extension_id)
@@ -1,9 +1,18 @@
 import logging
 import os
+from functools import lru_cache
 from typing import List, Dict, Any
 
+from extensions.config_persistence import ConfigPersistence
+
 logger = logging.getLogger(__name__)
 
+
+@lru_cache(maxsize=1)
+def _config_persistence() -> ConfigPersistence:
+    """ConfigPersistence compartilhado, criado só no primeiro uso (cria o diretório de dados)."""
+    return ConfigPersistence()
+
 class MockDBConnector:
     """
     Implementação de substituição para DBConnector quando o banco de dados não está disponível.
@@ -13,6 +22,8 @@ class MockDBConnector:
     def __init__(self):
         logger.info("Inicializando MockDBConnector para modo de compatibilidade")
         self.local_config = []
+        # mtime do arquivo local quando local_config foi carregado; None = nada em cache
+        self._local_mtime = None
         
     def connect(self):
         """Simula conexão bem-sucedida."""
@@ -31,14 +42,21 @@ class MockDBConnector:
         Returns:
             List[Dict]: Lista de configurações de ramais
         """
-        # Primeiro tenta carregar da configuração local
+        # Primeiro tenta carregar da configuração local (relida só se o arquivo mudou)
         try:
-            from extensions.config_persistence import ConfigPersistence
-            config_persistence = ConfigPersistence()
+            config_persistence = _config_persistence()
+            try:
+                mtime = os.stat(config_persistence.config_path).st_mtime_ns
+            except OSError:
+                mtime = None
+            if mtime is not None and mtime == self._local_mtime and self.local_config:
+                return self.local_config
+            
             saved_configs = config_persistence.load_configs()
             if saved_configs:
                 logger.info(f"Usando {len(saved_configs)} configurações de ramais do arquivo local")
                 self.local_config = saved_configs
+                self._local_mtime = mtime
                 return saved_configs
         except Exception as e:
             logger.warning(f"Erro ao carregar configurações locais: {e}")
@@ -60,6 +78,18 @@ class MockDBConnector:
         logger.info("Usando configuração padrão para modo de compatibilidade")
         return default_config
         
+    def get_extension(self, extension_id) -> Dict[str, Any]:
+        """
+        Retorna a configuração de um ramal pelo id, dentre as configurações locais.
+        
+        Returns:
+            Dict: Configuração do ramal ou None se não encontrada
+        """
+        for config in self.local_config or self.get_extensions():
+            if config.get('id') == extension_id:
+                return config
+        return None
+        
     def test_connection(self):
         """Simula teste de conexão bem-sucedido."""
         return True
\ No newline at end of file
@@ -1,12 +1,102 @@
 import asyncio
+import functools
 import logging
 import os
 import psutil
+import threading
 import time
-from typing import Dict, Set, Optional
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
+# Estado de cada sessão em ResourceManager._state (bits combináveis)
+ACTIVE = 1
+SPEAKING = 2
+TRANSCRIBING = 4
+
+# Throttling adaptativo: média móvel exponencial da CPU e faixa em que o fator sobe de 0 a 1
+CPU_EWMA_ALPHA = 0.2
+THROTTLE_CPU_START = 70.0
+THROTTLE_CPU_RANGE = 30.0
+
+@functools.lru_cache(maxsize=1)
+def _hardware_profile():
+    """(núcleos físicos, RAM total em GB) da máquina, consultados ao psutil uma única vez."""
+    return psutil.cpu_count(logical=False) or 2, psutil.virtual_memory().total / (1024**3)
+
+class FairSemaphore:
+    """
+    Semáforo com fila FIFO estrita: uma permissão liberada vai direto para o waiter
+    mais antigo, e novas chamadas não furam a fila enquanto houver alguém esperando.
+    """
+    
+    def __init__(self, value: int):
+        self._value = value
+        self._waiters = deque()
+    
+    def locked(self) -> bool:
+        return self._value == 0 or bool(self._waiters)
+    
+    def try_acquire(self) -> bool:
+        """Pega uma permissão sem esperar; False se não houver livre (ou se houver fila)."""
+        if self._value > 0 and not self._waiters:
+            self._value -= 1
+            return True
+        return False
+    
+    async def acquire(self) -> bool:
+        if self.try_acquire():
+            return True
+        
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # A permissão já tinha sido entregue a este waiter: repassar ao próximo
+                self.release()
+            else:
+                try:
+                    self._waiters.remove(fut)
+                except ValueError:
+                    pass
+            raise
+        return True
+    
+    def release(self):
+        while self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(True)
+                return
+        self._value += 1
+
+class ConnectionEntry:
+    """Conexão de socket ativa de uma perna da chamada (visitante ou morador)."""
+    
+    __slots__ = ('reader', 'writer', 'timestamp')
+    
+    def __init__(self, reader: Any, writer: Any, timestamp: int):
+        self.reader = reader
+        self.writer = writer
+        self.timestamp = timestamp
+
+class SessionMetrics:
+    """Métricas de performance de uma sessão (atributos fixos em __slots__, sem dict por instância)."""
+    
+    __slots__ = ('start_time_ns', 'port', 'transcription_count', 'synthesis_count',
+                 'transcription_time_ms', 'synthesis_time_ms')
+    
+    def __init__(self, start_time_ns: int, port: Optional[int] = None):
+        self.start_time_ns = start_time_ns
+        self.port = port
+        self.transcription_count = 0
+        self.synthesis_count = 0
+        self.transcription_time_ms = 0.0
+        self.synthesis_time_ms = 0.0
+
 class ResourceManager:
     """
     Classe responsável por gerenciar recursos do sistema para evitar sobrecarga
@@ -14,24 +104,39 @@ class ResourceManager:
     """
     
     def __init__(self):
-        # Contadores de recursos em uso
-        self.active_sessions: Set[str] = set()
-        self.speaking_sessions: Set[str] = set()
-        self.transcribing_sessions: Set[str] = set()
+        # Estado de cada sessão: combinação de ACTIVE/SPEAKING/TRANSCRIBING
+        self._state: Dict[str, int] = {}
+        # Quantas sessões têm cada bit ligado: {ACTIVE: n, SPEAKING: n, TRANSCRIBING: n}
+        self._counts: Dict[int, int] = {ACTIVE: 0, SPEAKING: 0, TRANSCRIBING: 0}
         
         # Limites de simultaneidade 
         self.max_concurrent_transcriptions = int(os.getenv('MAX_CONCURRENT_TRANSCRIPTIONS', '3'))
         self.max_concurrent_synthesis = int(os.getenv('MAX_CONCURRENT_SYNTHESIS', '3'))
         
         # Semáforos para controle de acesso
-        self.transcription_semaphore = asyncio.Semaphore(self.max_concurrent_transcriptions)
-        self.synthesis_semaphore = asyncio.Semaphore(self.max_concurrent_synthesis)
+        self.transcription_semaphore = FairSemaphore(self.max_concurrent_transcriptions)
+        self.synthesis_semaphore = FairSemaphore(self.max_concurrent_synthesis)
         
         # Métricas de performance
-        self.metrics: Dict[str, Dict] = {}
+        self.metrics: Dict[str, SessionMetrics] = {}
         
         # Conexões ativas para cada sessão (permite enviar KIND_HANGUP)
-        self.active_connections: Dict[str, Dict] = {}
+        self._connections: Dict[Tuple[str, str], ConnectionEntry] = {}
+        
+        # Cache das métricas de CPU/memória de get_system_load (psutil é consultado no máximo a cada TTL)
+        self._load_cache: Optional[Dict[str, float]] = None
+        self._load_cache_ts = 0.0
+        self._load_cache_ttl = float(os.getenv('LOAD_CACHE_TTL', '1.0'))
+        # Serializa a renovação do cache: chamadas concorrentes (threads de
+        # get_system_load_async ou síncronas) contam cada amostra uma única vez na EWMA
+        self._load_refresh_lock = threading.Lock()
+        # CPU suavizada (EWMA), atualizada a cada nova amostra de get_system_load
+        self._cpu_ewma = 0.0
+        # Processo atual, reaproveitado entre leituras (o psutil guarda nele o estado do cpu_percent)
+        self._proc = psutil.Process()
+        # Primeira chamada sem intervalo só inicializa os contadores de CPU do psutil
+        psutil.cpu_percent(interval=None)
+        self._proc.cpu_percent(interval=None)
         
         # Ajustes dinâmicos baseados no hardware
         self._configure_based_on_hardware()
@@ -42,8 +147,7 @@ class ResourceManager:
     def _configure_based_on_hardware(self):
         """Configura limites baseados nos recursos do hardware."""
         try:
-            cpu_count = psutil.cpu_count(logical=False) or 2
-            mem_gb = psutil.virtual_memory().total / (1024**3)
+            cpu_count, mem_gb = _hardware_profile()
             
             # Ajustar limites com base em CPU e memória
             if cpu_count >= 4 and mem_gb >= 8:
@@ -64,58 +168,59 @@ class ResourceManager:
         except Exception as e:
             logger.warning(f"Erro ao configurar baseado no hardware: {e}. Usando valores padrão.")
     
+    def _set_flag(self, session_id: str, flag: int, on: bool):
+        """Liga/desliga um bit de estado da sessão, mantendo os contadores."""
+        state = self._state.get(session_id, 0)
+        if on:
+            if not state & flag:
+                self._state[session_id] = state | flag
+                self._counts[flag] += 1
+        elif state & flag:
+            state &= ~flag
+            if state:
+                self._state[session_id] = state
+            else:
+                # Sessões nunca registradas (ex.: só transcrição) não ficam acumuladas
+                del self._state[session_id]
+            self._counts[flag] -= 1
+    
     def register_session(self, session_id: str, port: Optional[int] = None):
         """Registra uma nova sessão ativa."""
-        self.active_sessions.add(session_id)
-        self.metrics[session_id] = {
-            'start_time': time.time(),
-            'port': port,
-            'transcription_count': 0,
-            'synthesis_count': 0,
-            'transcription_time_ms': 0,
-            'synthesis_time_ms': 0
-        }
-        logger.debug(f"Sessão {session_id} registrada. Total de sessões ativas: {len(self.active_sessions)}")
+        self._set_flag(session_id, ACTIVE, True)
+        self.metrics[session_id] = SessionMetrics(start_time_ns=time.monotonic_ns(), port=port)
+        logger.debug(f"Sessão {session_id} registrada. Total de sessões ativas: {self._counts[ACTIVE]}")
     
     def unregister_session(self, session_id: str):
         """Remove uma sessão terminada."""
-        if session_id in self.active_sessions:
-            self.active_sessions.remove(session_id)
-        
-        if session_id in self.speaking_sessions:
-            self.speaking_sessions.remove(session_id)
-            
-        if session_id in self.transcribing_sessions:
-            self.transcribing_sessions.remove(session_id)
+        state = self._state.pop(session_id, 0)
+        for flag in (ACTIVE, SPEAKING, TRANSCRIBING):
+            if state & flag:
+                self._counts[flag] -= 1
             
         # Registrar métricas finais
-        if session_id in self.metrics:
-            duration = time.time() - self.metrics[session_id]['start_time']
+        metrics = self.metrics.pop(session_id, None)
+        if metrics is not None:
+            duration = (time.monotonic_ns() - metrics.start_time_ns) * 1e-9
             logger.info(f"Sessão {session_id} encerrada após {duration:.1f}s. "
-                       f"Transcrições: {self.metrics[session_id]['transcription_count']}, "
-                       f"Sínteses: {self.metrics[session_id]['synthesis_count']}")
-            del self.metrics[session_id]
+                       f"Transcrições: {metrics.transcription_count}, "
+                       f"Sínteses: {metrics.synthesis_count}")
     
     def set_speaking(self, session_id: str, is_speaking: bool):
         """Marca uma sessão como falando ou não."""
-        if is_speaking:
-            self.speaking_sessions.add(session_id)
-        elif session_id in self.speaking_sessions:
-            self.speaking_sessions.remove(session_id)
+        self._set_flag(session_id, SPEAKING, is_speaking)
     
     def set_transcribing(self, session_id: str, is_transcribing: bool):
         """Marca uma sessão como transcrevendo ou não."""
-        if is_transcribing:
-            self.transcribing_sessions.add(session_id)
-        elif session_id in self.transcribing_sessions:
-            self.transcribing_sessions.remove(session_id)
+        self._set_flag(session_id, TRANSCRIBING, is_transcribing)
     
     async def acquire_transcription_lock(self, session_id: str):
         """
         Adquire um lock para transcrição, limitando o número de transcrições
         simultâneas para evitar sobrecarga de CPU/memória.
         """
-        await self.transcription_semaphore.acquire()
+        # Caminho rápido sem contenção: nem cria a corrotina de acquire()
+        if not self.transcription_semaphore.try_acquire():
+            await self.transcription_semaphore.acquire()
         self.set_transcribing(session_id, True)
         return True
     
@@ -129,7 +234,8 @@ class ResourceManager:
         Adquire um lock para síntese de voz, limitando o número de sínteses
         simultâneas para evitar sobrecarga.
         """
-        await self.synthesis_semaphore.acquire()
+        if not self.synthesis_semaphore.try_acquire():
+            await self.synthesis_semaphore.acquire()
         return True
     
     def release_synthesis_lock(self, session_id: str):
@@ -138,27 +244,69 @@ class ResourceManager:
     
     def record_transcription(self, session_id: str, duration_ms: float):
         """Registra métricas de uma transcrição."""
-        if session_id in self.metrics:
-            self.metrics[session_id]['transcription_count'] += 1
-            self.metrics[session_id]['transcription_time_ms'] += duration_ms
+        metrics = self.metrics.get(session_id)
+        if metrics is not None:
+            metrics.transcription_count += 1
+            metrics.transcription_time_ms += duration_ms
     
     def record_synthesis(self, session_id: str, duration_ms: float):
         """Registra métricas de uma síntese."""
-        if session_id in self.metrics:
-            self.metrics[session_id]['synthesis_count'] += 1
-            self.metrics[session_id]['synthesis_time_ms'] += duration_ms
+        metrics = self.metrics.get(session_id)
+        if metrics is not None:
+            metrics.synthesis_count += 1
+            metrics.synthesis_time_ms += duration_ms
+    
+    def _read_proc_stats(self):
+        """Lê CPU (%) e memória residente (bytes) do processo numa única passada por /proc."""
+        with self._proc.oneshot():
+            return self._proc.cpu_percent(interval=None), self._proc.memory_info().rss
     
     def get_system_load(self):
-        """Retorna informações sobre o carregamento atual do sistema."""
+        """
+        Versão síncrona de get_system_load_async, mantida só como fallback para quem
+        não está no event loop: ao renovar o cache, lê /proc na thread atual.
+        """
+        return self._get_system_load_sync()
+    
+    async def get_system_load_async(self):
+        """
+        Retorna a carga do sistema sem bloquear o event loop: com o cache válido
+        responde direto; ao renová-lo, a leitura do psutil roda numa thread.
+        """
+        if self._load_cache is not None and time.monotonic() - self._load_cache_ts < self._load_cache_ttl:
+            return self._get_system_load_sync()
+        return await asyncio.to_thread(self._get_system_load_sync)
+    
+    def _get_system_load_sync(self):
+        """
+        Retorna informações sobre o carregamento atual do sistema.
+        CPU e memória vêm de um cache renovado no máximo a cada LOAD_CACHE_TTL segundos;
+        o uso de CPU é a média desde a amostra anterior (sem bloquear). Após um longo
+        período sem chamadas, essa média cobre todo o período; sem amostra anterior
+        (contadores recém-inicializados) o psutil retorna 0.0.
+        """
         try:
-            cpu_percent = psutil.cpu_percent(interval=0.1)
-            mem_percent = psutil.virtual_memory().percent
+            if self._load_cache is None or time.monotonic() - self._load_cache_ts >= self._load_cache_ttl:
+                with self._load_refresh_lock:
+                    # Conferir de novo sob o lock: outra thread pode ter acabado de renovar
+                    now = time.monotonic()
+                    if self._load_cache is None or now - self._load_cache_ts >= self._load_cache_ttl:
+                        proc_cpu, proc_rss = self._read_proc_stats()
+                        cpu_percent = psutil.cpu_percent(interval=None)
+                        self._cpu_ewma = (1 - CPU_EWMA_ALPHA) * self._cpu_ewma + CPU_EWMA_ALPHA * cpu_percent
+                        self._load_cache = {
+                            'cpu_percent': cpu_percent,
+                            'cpu_ewma': self._cpu_ewma,
+                            'memory_percent': psutil.virtual_memory().percent,
+                            'process_cpu_percent': proc_cpu,
+                            'process_rss_mb': proc_rss / (1024**2),
+                        }
+                        self._load_cache_ts = time.monotonic()
             return {
-                'cpu_percent': cpu_percent,
-                'memory_percent': mem_percent,
-                'active_sessions': len(self.active_sessions),
-                'speaking_sessions': len(self.speaking_sessions),
-                'transcribing_sessions': len(self.transcribing_sessions)
+                **self._load_cache,
+                'active_sessions': self._counts[ACTIVE],
+                'speaking_sessions': self._counts[SPEAKING],
+                'transcribing_sessions': self._counts[TRANSCRIBING]
             }
         except Exception as e:
             logger.error(f"Erro ao obter carga do sistema: {e}")
@@ -166,17 +314,20 @@ class ResourceManager:
                 'error': str(e)
             }
             
-    def should_throttle_audio(self):
-        """
-        Determina se a transmissão de áudio deve ser limitada com base na carga do sistema.
-        Retorna True se o sistema estiver sobrecarregado.
+    async def should_throttle_audio(self) -> float:
         """
-        system_load = self.get_system_load()
-        cpu_percent = system_load.get('cpu_percent', 0)
-        active_sessions = system_load.get('active_sessions', 0)
+        Calcula quanto a transmissão de áudio deve ser limitada com base na carga do sistema.
         
-        # Se temos muitas sessões ativas E a CPU está alta, ativamos throttling
-        return active_sessions > 3 and cpu_percent > 85
+        Returns:
+            float: Fator de 0.0 (sem limitação) a 1.0 (limitação máxima). Cresce de forma
+            gradual com a CPU suavizada acima de THROTTLE_CPU_START e com a ocupação de
+            sessões em relação ao limite de transcrições simultâneas; quem chama reduz a
+            taxa de envio de áudio na mesma proporção.
+        """
+        await self.get_system_load_async()
+        cpu_factor = max(0.0, (self._cpu_ewma - THROTTLE_CPU_START) / THROTTLE_CPU_RANGE)
+        session_factor = self._counts[ACTIVE] / max(self.max_concurrent_transcriptions, 1)
+        return min(1.0, cpu_factor * session_factor)
         
     def register_connection(self, call_id: str, role: str, reader, writer):
         """
@@ -188,28 +339,16 @@ class ResourceManager:
             reader: StreamReader da conexão
             writer: StreamWriter da conexão
         """
-        if call_id not in self.active_connections:
-            self.active_connections[call_id] = {}
-            
-        self.active_connections[call_id][role] = {
-            'reader': reader,
-            'writer': writer,
-            'timestamp': time.time()
-        }
+        self._connections[(call_id, role)] = ConnectionEntry(reader, writer, time.monotonic_ns())
         logger.debug(f"Conexão registrada para {call_id} ({role})")
         
     def unregister_connection(self, call_id: str, role: str):
         """
         Remove uma conexão quando ela é encerrada.
         """
-        if call_id in self.active_connections and role in self.active_connections[call_id]:
-            del self.active_connections[call_id][role]
+        if self._connections.pop((call_id, role), None) is not None:
             logger.debug(f"Conexão removida para {call_id} ({role})")
-            
-            # Se não há mais conexões para esta chamada, limpar
-            if not self.active_connections[call_id]:
-                del self.active_connections[call_id]
-                
+    
     def get_active_connection(self, call_id: str, role: str):
         """
         Retorna informações sobre uma conexão ativa.
@@ -219,11 +358,9 @@ class ResourceManager:
             role: 'visitor' ou 'resident'
             
         Returns:
-            Dict com reader e writer, ou None se não existir
+            ConnectionEntry com reader e writer, ou None se não existir
         """
-        if call_id in self.active_connections and role in self.active_connections[call_id]:
-            return self.active_connections[call_id][role]
-        return None
+        return self._connections.get((call_id, role))
 
 # Instância global
 resource_manager = ResourceManager()
\ No newline at end of file
@@ -1,13 +1,27 @@
 import asyncio
+import json
 import logging
 import socket
-from typing import Dict, List, Tuple, Any
+from collections import defaultdict
+from operator import itemgetter
+from typing import Dict, List, Optional, Tuple, Any
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Importar handlers do audiosocket dinamicamente
 from audiosocket_handler import iniciar_servidor_audiosocket_visitante, iniciar_servidor_audiosocket_morador
 
 logger = logging.getLogger(__name__)
 
+# Campos de cada ramal no /api/status: itemgetter extrai os valores da config de uma vez (em C)
+_STATUS_OUT_KEYS = ("id", "ramal_ia", "ramal_retorno", "ip", "porta_ia", "porta_retorno", "condominio_id", "status")
+_status_values = itemgetter('ramal_ia', 'ramal_retorno', 'ip_servidor', 'porta_ia', 'porta_retorno', 'condominio_id')
+
+# Máximo de ramais sendo iniciados ao mesmo tempo (checagem de portas + bind dos dois sockets)
+MAX_CONCURRENT_STARTS = 8
+
 class ServerManager:
     """
     Classe responsável por gerenciar os servidores socket para ramais de IA.
@@ -30,6 +44,54 @@ class ServerManager:
         # Mapeamento reverso de porta de retorno para porta de IA
         # {porta_retorno: porta_ia}
         self.return_to_ia_port: Dict[int, int] = {}
+        
+        # Resposta do /api/status já serializada; recalculada só após iniciar/parar servidores
+        self._status_snapshot: Optional[bytes] = None
+        
+        # Limita inicializações simultâneas vindas de start_all_servers, notificações e API
+        self._start_limit = asyncio.Semaphore(MAX_CONCURRENT_STARTS)
+        
+        # Uma alteração por ramal de cada vez: notificações, /api/restart e refresh
+        # usam o mesmo lock, então stop/start do mesmo ramal nunca se intercalam
+        self._id_locks: Dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+    
+    def extension_lock(self, extension_id) -> asyncio.Lock:
+        """Retorna o lock que serializa as alterações de um ramal."""
+        return self._id_locks[extension_id]
+    
+    def discard_extension_lock(self, extension_id):
+        """Descarta o lock de um ramal removido, se ninguém mais o aguarda."""
+        lock = self._id_locks.get(extension_id)
+        if lock is not None and not lock.locked():
+            del self._id_locks[extension_id]
+    
+    def _invalidate_status(self):
+        """Descarta o snapshot de status após qualquer alteração em self.servers."""
+        self._status_snapshot = None
+    
+    def get_status_bytes(self) -> bytes:
+        """
+        Retorna o corpo JSON do /api/status, montado uma única vez por alteração
+        na lista de servidores.
+        
+        Returns:
+            bytes: {"status": "success", "total_extensions": N, "extensions": [...]}
+        """
+        if self._status_snapshot is None:
+            extensions = [
+                dict(zip(_STATUS_OUT_KEYS, (extension_id, *_status_values(server_data['config']), "ativo")))
+                for extension_id, server_data in self.servers.items()
+            ]
+            status = {
+                "status": "success",
+                "total_extensions": len(extensions),
+                "extensions": extensions
+            }
+            if orjson is not None:
+                self._status_snapshot = orjson.dumps(status)
+            else:
+                self._status_snapshot = json.dumps(status, separators=(',', ':')).encode('utf-8')
+        return self._status_snapshot
     
     def is_port_available(self, ip: str, port: int) -> bool:
         """
@@ -53,6 +115,19 @@ class ServerManager:
         return result
     
     async def start_server(self, config: Dict[str, Any]) -> Tuple[asyncio.Server, asyncio.Server]:
+        """
+        Inicia servidores socket para um ramal específico, respeitando MAX_CONCURRENT_STARTS.
+        
+        Args:
+            config: Dicionário com configuração do ramal
+            
+        Returns:
+            Tuple contendo os servidores de IA e retorno, ou levanta exceção se não for possível iniciar
+        """
+        async with self._start_limit:
+            return await self._start_server(config)
+    
+    async def _start_server(self, config: Dict[str, Any]) -> Tuple[asyncio.Server, asyncio.Server]:
         """
         Inicia servidores socket para um ramal específico.
         
@@ -115,6 +190,7 @@ class ServerManager:
                 'retorno_server': retorno_server,
                 'config': config_copy
             }
+            self._invalidate_status()
             
             # Atualizar mapeamentos
             self.port_to_extension[porta_ia] = extension_id
@@ -166,20 +242,21 @@ class ServerManager:
             porta_retorno = config['porta_retorno']
             ramal_ia = config['ramal_ia']
             
-            if porta_ia in self.port_to_extension:
+            # Só remover mapeamentos que ainda apontam para este ramal: a porta ou o
+            # ramal pode já ter sido reutilizado por outra configuração
+            if self.port_to_extension.get(porta_ia) == extension_id:
                 del self.port_to_extension[porta_ia]
             
-            if porta_retorno in self.port_to_extension:
+            if self.port_to_extension.get(porta_retorno) == extension_id:
                 del self.port_to_extension[porta_retorno]
+                self.return_to_ia_port.pop(porta_retorno, None)
             
-            if ramal_ia in self.extension_to_id:
+            if self.extension_to_id.get(ramal_ia) == extension_id:
                 del self.extension_to_id[ramal_ia]
             
-            if porta_retorno in self.return_to_ia_port:
-                del self.return_to_ia_port[porta_retorno]
-            
             # Remover da lista de servidores
             del self.servers[extension_id]
+            self._invalidate_status()
             
             logger.info(f"Servidores para ramal {ramal_ia} parados com sucesso")
             return True
@@ -199,15 +276,13 @@ class ServerManager:
             int: Número de servidores iniciados com sucesso
         """
         success_count = 0
-        tasks = []
-        
-        # Iniciar todos os servidores em paralelo para melhorar performance
-        for config in configs:
-            task = asyncio.create_task(self._safe_start_server(config))
-            tasks.append(task)
         
-        # Esperar que todos os servidores sejam iniciados
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        # Iniciar os servidores em paralelo (no máximo MAX_CONCURRENT_STARTS por vez)
+        # e esperar que todos terminem
+        results = await asyncio.gather(
+            *(self._safe_start_server(config) for config in configs),
+            return_exceptions=True
+        )
         
         # Contar os servidores iniciados com sucesso
         for result in results:
@@ -240,7 +315,8 @@ class ServerManager:
     async def restart_servers(self, new_configs: List[Dict[str, Any]]) -> Tuple[int, int, int]:
         """
         Reinicia os servidores com novas configurações. 
-        Para servidores que não existem mais, inicia novos e atualiza os existentes.
+        Para servidores que não existem mais, inicia novos e atualiza os existentes;
+        ramais sem mudança não são tocados.
         
         Args:
             new_configs: Lista com novas configurações de ramais
@@ -248,50 +324,89 @@ class ServerManager:
         Returns:
             Tuple[int, int, int]: Contadores de (removidos, atualizados, adicionados)
         """
-        removed_count = 0
-        updated_count = 0
-        added_count = 0
-        
         # Mapear novos configs por ID para fácil acesso
         new_configs_map = {config['id']: config for config in new_configs}
         
-        # Remover servidores que não estão mais nas configurações
-        current_ids = set(self.servers.keys())
-        new_ids = set(new_configs_map.keys())
-        
-        # IDs a serem removidos
-        for extension_id in current_ids - new_ids:
-            success = await self.stop_server(extension_id)
-            if success:
-                removed_count += 1
+        # Diferença contra os servidores ativos: só o que mudou é parado/iniciado
+        removed_ids = set(self.servers.keys()) - set(new_configs_map.keys())
+        changed = [
+            config for config in new_configs
+            if config['id'] in self.servers
+            and self._config_changed(self.servers[config['id']]['config'], config)
+        ]
+        added = [config for config in new_configs if config['id'] not in self.servers]
+        
+        # Parar removidos e alterados até o fim antes de iniciar qualquer servidor:
+        # a porta ou o ramal de um deles pode ter sido reutilizado por outra configuração
+        stop_results = await asyncio.gather(
+            *(self._remove_server(extension_id) for extension_id in removed_ids),
+            *(self._stop_changed_server(config['id']) for config in changed)
+        )
+        removed_count = sum(stop_results[:len(removed_ids)])
+        
+        # Depois iniciar alterados e novos em paralelo
+        start_results = await asyncio.gather(
+            *(self._start_changed_server(config) for config in changed),
+            *(self._start_new_server(config) for config in added)
+        )
+        updated_count = sum(start_results[:len(changed)])
+        added_count = sum(start_results[len(changed):])
+        
+        self._invalidate_status()
+        return removed_count, updated_count, added_count
+    
+    async def restart_server(self, extension_id) -> bool:
+        """
+        Para e inicia novamente, com a configuração atual, os servidores de um ramal
+        sob o lock do ramal.
         
-        # Atualizar servidores existentes ou adicionar novos
-        for config in new_configs:
-            extension_id = config['id']
+        Args:
+            extension_id: ID do ramal
             
-            if extension_id in self.servers:
-                # Verificar se configuração mudou
-                old_config = self.servers[extension_id]['config']
-                
-                if self._config_changed(old_config, config):
-                    # Se configuração mudou, reiniciar servidor
-                    await self.stop_server(extension_id)
-                    try:
-                        await self.start_server(config)
-                        updated_count += 1
-                        logger.info(f"Servidor para ramal {config['ramal_ia']} atualizado com sucesso")
-                    except Exception as e:
-                        logger.error(f"Erro ao atualizar servidor para ramal {config['ramal_ia']}: {e}")
-            else:
-                # Iniciar novo servidor
-                try:
-                    await self.start_server(config)
-                    added_count += 1
-                    logger.info(f"Novo servidor para ramal {config['ramal_ia']} iniciado com sucesso")
-                except Exception as e:
-                    logger.error(f"Erro ao iniciar novo servidor para ramal {config['ramal_ia']}: {e}")
-        
-        return removed_count, updated_count, added_count
+        Returns:
+            bool: False se o ramal não está (mais) ativo
+        """
+        async with self.extension_lock(extension_id):
+            if extension_id not in self.servers:
+                return False
+            config = self.servers[extension_id]['config']
+            await self.stop_server(extension_id)
+            await self.start_server(config)
+            return True
+    
+    async def _remove_server(self, extension_id) -> bool:
+        """Para os servidores de um ramal que saiu das configurações."""
+        async with self.extension_lock(extension_id):
+            stopped = await self.stop_server(extension_id)
+        self.discard_extension_lock(extension_id)
+        return stopped
+    
+    async def _stop_changed_server(self, extension_id) -> bool:
+        """Para o servidor de um ramal cuja configuração mudou (reiniciado em seguida)."""
+        async with self.extension_lock(extension_id):
+            return await self.stop_server(extension_id)
+    
+    async def _start_changed_server(self, config: Dict[str, Any]) -> bool:
+        """Inicia com a nova configuração o servidor de um ramal já parado por _stop_changed_server."""
+        try:
+            async with self.extension_lock(config['id']):
+                await self.start_server(config)
+            logger.info(f"Servidor para ramal {config['ramal_ia']} atualizado com sucesso")
+            return True
+        except Exception as e:
+            logger.error(f"Erro ao atualizar servidor para ramal {config['ramal_ia']}: {e}")
+            return False
+    
+    async def _start_new_server(self, config: Dict[str, Any]) -> bool:
+        """Inicia o servidor de um ramal que ainda não está ativo."""
+        try:
+            async with self.extension_lock(config['id']):
+                await self.start_server(config)
+            logger.info(f"Novo servidor para ramal {config['ramal_ia']} iniciado com sucesso")
+            return True
+        except Exception as e:
+            logger.error(f"Erro ao iniciar novo servidor para ramal {config['ramal_ia']}: {e}")
+            return False
     
     def _config_changed(self, old_config: Dict[str, Any], new_config: Dict[str, Any]) -> bool:
         """
@@ -0,0 +1,30 @@
+-- Notificações de alteração em public.extension_ia para o PostgresListener
+-- (canal change_record_extension_ia).
+--
+-- O payload é mínimo: {"action": "INSERT|UPDATE|DELETE", "id": <extension_ia_id>}.
+-- Para INSERT/UPDATE o ExtensionManager busca a linha completa com
+-- DBConnector.get_extension(id); para DELETE o id basta.
+--
+-- O listener usa uma conexão dedicada (application_name = 'ext_ia_listener'),
+-- nunca uma do pool de consultas ('ext_ia_query'). Se houver pgbouncer/Odyssey
+-- no caminho, essa conexão precisa de pool em modo session: em modo transaction
+-- o LISTEN se perde e as notificações deixam de chegar.
+
+CREATE OR REPLACE FUNCTION notify_ext_ia() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify(
+        'change_record_extension_ia',
+        json_build_object(
+            'action', TG_OP,
+            'id', CASE WHEN TG_OP = 'DELETE' THEN OLD.extension_ia_id ELSE NEW.extension_ia_id END
+        )::text
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_notify_ext_ia ON public.extension_ia;
+
+CREATE TRIGGER trg_notify_ext_ia
+    AFTER INSERT OR UPDATE OR DELETE ON public.extension_ia
+    FOR EACH ROW EXECUTE FUNCTION notify_ext_ia();
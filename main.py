@@ -10,6 +10,7 @@ from extensions.api_server import APIServer
 from extensions.server_manager import ServerManager
 from extensions.config_persistence import ConfigPersistence
 from extensions.db_connector import DBConnector
+from services import amqp_pool
 
 # Configurar logging
 logging.basicConfig(
@@ -142,6 +143,14 @@ async def main():
         )
 
 if __name__ == "__main__":
+    # uvloop (libuv) como loop do processo: atende AudioSocket e a API aiohttp com menos overhead.
+    # Opcional: sem ele (ex.: Windows) segue o loop padrão do asyncio
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        logger.info("uvloop não disponível, usando o loop padrão do asyncio")
+
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
@@ -150,3 +159,6 @@ if __name__ == "__main__":
     except Exception as e:
         logger.error(f"Erro fatal: {e}", exc_info=True)
         sys.exit(1)
+    finally:
+        # Entregar publicações AMQP (clicktocall) ainda pendentes antes de sair
+        amqp_pool.flush_sync()
@@ -0,0 +1,430 @@
+# services/amqp_pool.py
+
+"""
+Publicador AMQP persistente com confirmação de entrega (publisher confirms).
+
+Mantém uma única conexão pika assíncrona (AsyncioConnection) vinculada ao loop
+de eventos em que é usada pela primeira vez, com um pool de canais sobre ela
+(RABBITMQ_MAX_CHANNEL_POOL_SIZE, padrão 16), em vez de abrir uma
+BlockingConnection, um canal e refazer a autenticação a cada mensagem.
+"""
+
+import asyncio
+import logging
+import os
+from functools import partial
+from typing import Dict, Iterable, Optional, Set
+
+import pika
+from pika.adapters.asyncio_connection import AsyncioConnection
+
+logger = logging.getLogger(__name__)
+
+RABBIT_HOST = 'mqdev.tecnofy.com.br'
+RABBIT_USER = 'fonia'
+RABBIT_PASSWORD = 'fonia123'
+RABBIT_VHOST = 'voip'
+CLICKTOCALL_QUEUE = 'api-to-voip1'
+
+# Credenciais e parâmetros de conexão constantes, construídos uma única vez na importação
+_CREDS = pika.PlainCredentials(RABBIT_USER, RABBIT_PASSWORD)
+_PARAMS = pika.ConnectionParameters(
+    host=RABBIT_HOST,
+    virtual_host=RABBIT_VHOST,
+    credentials=_CREDS,
+    connection_attempts=2,  # Tentar conectar 2 vezes
+    retry_delay=1,          # 1 segundo entre tentativas
+    socket_timeout=5,       # 5 segundos de timeout
+    heartbeat=30,           # Detecta conexões mortas mesmo sem tráfego
+    blocked_connection_timeout=10  # Não fica preso indefinidamente se o broker bloquear publicações
+)
+
+# Propriedades compartilhadas por todas as publicações (mensagens persistentes em JSON)
+_PROPERTIES = pika.BasicProperties(delivery_mode=2, content_type='application/json')
+
+# Agrupamento de publicações: até _BATCH_MAX mensagens coalescidas numa janela de _BATCH_WINDOW segundos
+_BATCH_MAX = 64
+_BATCH_WINDOW = 0.005
+_CONFIRM_TIMEOUT = 5.0
+
+# Intervalo entre tentativas de reconexão automática após queda da conexão
+_RECONNECT_DELAY = 5.0
+
+# Quantidade de canais abertos sobre a conexão única (lotes em voo simultaneamente)
+_POOL_SIZE = int(os.getenv('RABBITMQ_MAX_CHANNEL_POOL_SIZE', '16'))
+
+
+class _ConfirmChannel:
+    """Canal em modo confirm com seu próprio contador de delivery tags e confirmações pendentes."""
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.delivery_tag = 0
+        self.pending: Dict[int, asyncio.Future] = {}
+
+    def publish(self, queue: str, body, future: asyncio.Future) -> int:
+        self.delivery_tag += 1
+        self.pending[self.delivery_tag] = future
+        self.channel.basic_publish(
+            exchange='',
+            routing_key=queue,
+            body=body,
+            properties=_PROPERTIES
+        )
+        return self.delivery_tag
+
+    def on_delivery_confirmation(self, frame):
+        """Resolve os futures pendentes com True (ack) ou False (nack)."""
+        method = frame.method
+        acked = isinstance(method, pika.spec.Basic.Ack)
+        if method.multiple:
+            tags = [tag for tag in self.pending if tag <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag]
+
+        for tag in tags:
+            future = self.pending.pop(tag, None)
+            if future is not None and not future.done():
+                future.set_result(acked)
+
+    def fail_all(self, error):
+        pending, self.pending = self.pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+
+class AmqpPublisher:
+    """
+    Conexão AMQP persistente com publisher confirms e um pool de canais.
+
+    Todas as chamadas devem ocorrer no mesmo loop de eventos: a conexão é
+    criada no loop em execução no primeiro publish e reaberta sob demanda
+    quando o broker ou a rede a derrubam. Após uma queda, a reconexão é
+    tentada em segundo plano para que o próximo publish encontre o canal pronto.
+
+    As publicações são enfileiradas e agrupadas em lotes por uma única tarefa;
+    cada lote ocupa um canal do pool enquanto aguarda suas confirmações, de modo
+    que até pool_size lotes ficam em voo ao mesmo tempo.
+    """
+
+    def __init__(self, parameters: pika.ConnectionParameters, queues: Iterable[str] = (),
+                 pool_size: int = _POOL_SIZE):
+        self._parameters = parameters
+        self._queues = tuple(queues)
+        self._declared_queues: Set[str] = set()  # Filas já declaradas na conexão atual
+        self._pool_size = max(1, pool_size)
+        self._connection: Optional[AsyncioConnection] = None
+        self._ready: Optional[asyncio.Future] = None
+        self._channels = set()
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._drain_task: Optional[asyncio.Task] = None
+        self._inflight = set()
+        self._reconnect_handle: Optional[asyncio.TimerHandle] = None
+        self._closing = False
+        self._batching = False  # Há um lote retirado da fila e ainda não entregue a um canal
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _is_ready(self) -> bool:
+        return (
+            self._connection is not None and self._connection.is_open
+            and self._ready is not None and self._ready.done()
+            and not self._ready.cancelled() and self._ready.exception() is None
+        )
+
+    async def _ensure_connection(self):
+        """Garante a conexão pronta, conectando (ou aguardando a conexão em curso) se necessário."""
+        if self._is_ready():
+            return
+
+        if self._ready is None or self._ready.done():
+            self._ready = asyncio.get_running_loop().create_future()
+            self._connect()
+
+        # shield: o cancelamento de um publicador não deve abortar a conexão dos demais
+        await asyncio.shield(self._ready)
+
+    def _close_connection(self):
+        """Fecha e esquece a conexão atual; o callback de fechamento dela passa a ser ignorado."""
+        connection, self._connection = self._connection, None
+        self._declared_queues.clear()
+        if connection is not None and not (connection.is_closing or connection.is_closed):
+            connection.close()
+
+    def _connect(self):
+        # Nunca sobrescrever uma conexão ainda aberta (ela vazaria com seus callbacks ignorados)
+        self._close_connection()
+        logger.info("[AMQP] Abrindo conexão persistente com %s...", self._parameters.host)
+        self._connection = AsyncioConnection(
+            self._parameters,
+            on_open_callback=self._on_connection_open,
+            on_open_error_callback=self._on_connection_open_error,
+            on_close_callback=self._on_connection_closed,
+            custom_ioloop=asyncio.get_running_loop()
+        )
+
+    def _on_connection_open(self, connection):
+        # O primeiro canal declara as filas; os demais são abertos quando ele estiver pronto
+        connection.channel(on_open_callback=self._on_first_channel_open)
+
+    def _on_connection_open_error(self, connection, error):
+        if connection is not self._connection:
+            return
+        logger.error("[AMQP] Falha ao conectar em %s: %s", self._parameters.host, error)
+        self._connection = None
+        if not isinstance(error, BaseException):
+            error = pika.exceptions.AMQPConnectionError(error)
+        self._fail_all(error)
+        self._schedule_reconnect()
+
+    def _on_connection_closed(self, connection, reason):
+        if connection is not self._connection:
+            return
+        logger.warning("[AMQP] Conexão encerrada: %s", reason)
+        self._connection = None
+        self._declared_queues.clear()
+        self._fail_all(reason)
+        self._schedule_reconnect()
+
+    def _schedule_reconnect(self):
+        if self._closing or self._reconnect_handle is not None:
+            return
+        self._reconnect_handle = asyncio.get_running_loop().call_later(_RECONNECT_DELAY, self._reconnect)
+
+    def _reconnect(self):
+        """Reabre a conexão em segundo plano, sem depender de um publish pendente."""
+        self._reconnect_handle = None
+        if self._closing or self._connection is not None:
+            return
+
+        logger.info("[AMQP] Tentando reconexão automática...")
+        self._ready = asyncio.get_running_loop().create_future()
+        # Ninguém aguarda este future necessariamente; evita aviso de exceção não consumida
+        self._ready.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._connect()
+
+    def _register_channel(self, channel) -> _ConfirmChannel:
+        confirm_channel = _ConfirmChannel(channel)
+        channel.add_on_close_callback(partial(self._on_channel_closed, confirm_channel))
+        channel.confirm_delivery(confirm_channel.on_delivery_confirmation)
+        self._channels.add(confirm_channel)
+        return confirm_channel
+
+    def _on_first_channel_open(self, channel):
+        self._declare_queues(self._register_channel(channel), list(self._queues))
+
+    def _on_channel_open(self, channel):
+        self._idle.put_nowait(self._register_channel(channel))
+
+    def _open_channel(self):
+        if not self._closing and self._connection is not None and self._connection.is_open:
+            self._connection.channel(on_open_callback=self._on_channel_open)
+
+    def _declare_queues(self, confirm_channel: _ConfirmChannel, remaining):
+        """Declara as filas configuradas em sequência e libera os publicadores ao final."""
+        if not remaining:
+            logger.info("[AMQP] Conexão pronta com publisher confirms (%s canais)", self._pool_size)
+            self._idle.put_nowait(confirm_channel)
+            for _ in range(self._pool_size - 1):
+                self._open_channel()
+            if self._ready is not None and not self._ready.done():
+                self._ready.set_result(True)
+            return
+
+        queue = remaining.pop(0)
+
+        def on_declared(_frame):
+            self._declared_queues.add(queue)
+            self._declare_queues(confirm_channel, remaining)
+
+        confirm_channel.channel.queue_declare(queue=queue, durable=True, passive=False, callback=on_declared)
+
+    async def _declare_queue(self, confirm_channel: _ConfirmChannel, queue: str):
+        """Declara uma fila fora da lista inicial; o resultado vale até a próxima queda de canal/conexão."""
+        declared = asyncio.get_running_loop().create_future()
+        confirm_channel.channel.queue_declare(
+            queue=queue,
+            durable=True,
+            passive=False,
+            callback=lambda _frame: declared.done() or declared.set_result(True)
+        )
+        await asyncio.wait_for(declared, timeout=_CONFIRM_TIMEOUT)
+        self._declared_queues.add(queue)
+
+    def _on_channel_closed(self, confirm_channel: _ConfirmChannel, channel, reason):
+        self._channels.discard(confirm_channel)
+        # O fechamento pode indicar fila removida (ex.: broker reiniciado): redeclara no próximo uso
+        self._declared_queues.clear()
+        confirm_channel.fail_all(reason)
+        if self._ready is not None and not self._ready.done():
+            # Falha ainda na preparação (ex.: declaração da fila recusada): a conexão é
+            # descartada aqui, e o próximo publish abre uma nova do zero
+            self._close_connection()
+            self._ready.set_exception(reason)
+            return
+        # Repõe o canal no pool enquanto a conexão estiver de pé
+        if self._connection is not None and self._connection.is_open:
+            logger.warning("[AMQP] Canal encerrado, abrindo substituto: %s", reason)
+            self._open_channel()
+
+    def _fail_all(self, error):
+        """Propaga a falha para a conexão em curso e para as confirmações pendentes de todos os canais."""
+        if self._ready is not None and not self._ready.done():
+            self._ready.set_exception(error)
+        channels, self._channels = self._channels, set()
+        for confirm_channel in channels:
+            confirm_channel.fail_all(error)
+        while not self._idle.empty():
+            self._idle.get_nowait()
+
+    async def _acquire_channel(self) -> _ConfirmChannel:
+        """Retira um canal livre do pool, descartando os que foram fechados nesse meio tempo."""
+        while True:
+            confirm_channel = await self._idle.get()
+            if confirm_channel in self._channels and confirm_channel.channel.is_open:
+                return confirm_channel
+
+    def publish(self, queue: str, body, correlation_id: str = None) -> asyncio.Future:
+        """
+        Enfileira uma mensagem para o próximo lote de publicação.
+
+        Args:
+            queue: Nome da fila de destino (exchange padrão)
+            body: Corpo da mensagem (str ou bytes)
+            correlation_id: Identificador usado apenas para rastreio nos logs
+
+        Returns:
+            asyncio.Future: Resolve para True se o broker confirmou (ack),
+            False se rejeitou (nack)
+        """
+        loop = asyncio.get_running_loop()
+        self._loop = loop
+        if self._drain_task is None or self._drain_task.done():
+            self._drain_task = loop.create_task(self._drain())
+
+        confirmation = loop.create_future()
+        self._queue.put_nowait((queue, body, correlation_id, confirmation))
+        return confirmation
+
+    async def _drain(self):
+        """Consome a fila de publicações, agrupando mensagens próximas no tempo."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            self._batching = True
+            self._collect(batch)
+            if len(batch) < _BATCH_MAX:
+                # Janela curta para coalescer publicações concorrentes
+                await asyncio.sleep(_BATCH_WINDOW)
+                self._collect(batch)
+
+            # Descarta mensagens cujo chamador já desistiu (timeout/cancelamento)
+            batch = [item for item in batch if not item[3].done()]
+            if not batch:
+                self._batching = False
+                continue
+
+            try:
+                try:
+                    await self._ensure_connection()
+                except pika.exceptions.AMQPConnectionError as e:
+                    # Conexão perdida/fechada (ex.: StreamLostError): descarta e tenta reconectar uma única vez
+                    logger.warning("[AMQP] Conexão indisponível (%r), tentando reconectar uma vez...", e)
+                    await self._ensure_connection()
+                confirm_channel = await asyncio.wait_for(self._acquire_channel(), timeout=_CONFIRM_TIMEOUT)
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    e = pika.exceptions.AMQPChannelError("Nenhum canal AMQP livre no pool")
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                self._batching = False
+                continue
+
+            # O lote segue em voo no seu canal enquanto o próximo é montado
+            task = loop.create_task(self._flush(confirm_channel, batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+            self._batching = False
+
+    def _collect(self, batch):
+        while len(batch) < _BATCH_MAX and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+
+    async def _flush(self, confirm_channel: _ConfirmChannel, batch):
+        """Publica o lote no canal e aguarda as confirmações de todas as mensagens."""
+        try:
+            for queue, body, correlation_id, future in batch:
+                if queue not in self._declared_queues:
+                    await self._declare_queue(confirm_channel, queue)
+                tag = confirm_channel.publish(queue, body, future)
+                logger.debug("[AMQP] Publicado em %s (delivery_tag=%s, correlation_id=%s)", queue, tag, correlation_id)
+
+            # Uma única espera pelas confirmações do lote inteiro
+            await asyncio.wait([future for *_, future in batch], timeout=_CONFIRM_TIMEOUT)
+        except Exception as e:
+            logger.error("[AMQP] Erro inesperado ao publicar lote: %s", e, exc_info=True)
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            # Devolve o canal ao pool se ele continua utilizável
+            if confirm_channel in self._channels and confirm_channel.channel.is_open:
+                self._idle.put_nowait(confirm_channel)
+
+    async def flush(self):
+        """Aguarda até que todas as mensagens enfileiradas tenham sido publicadas e confirmadas."""
+        while not self._queue.empty() or self._batching or self._inflight:
+            if self._inflight:
+                await asyncio.wait(list(self._inflight))
+            else:
+                await asyncio.sleep(_BATCH_WINDOW)
+
+    async def close(self):
+        """Entrega o que estiver pendente e encerra a conexão sem reconectar."""
+        self._closing = True
+        if self._drain_task is not None and not self._drain_task.done():
+            await self.flush()
+            self._drain_task.cancel()
+        if self._reconnect_handle is not None:
+            self._reconnect_handle.cancel()
+            self._reconnect_handle = None
+        if self._connection is not None and self._connection.is_open:
+            self._connection.close()
+        logger.info("[AMQP] Publicador encerrado")
+
+
+_publisher: Optional[AmqpPublisher] = None
+
+
+def get_publisher() -> AmqpPublisher:
+    """Retorna o publicador compartilhado, criando-o na primeira chamada."""
+    global _publisher
+    if _publisher is None:
+        _publisher = AmqpPublisher(_PARAMS, queues=[CLICKTOCALL_QUEUE])
+    return _publisher
+
+
+def publish(queue: str, body, correlation_id: str = None) -> asyncio.Future:
+    """
+    Enfileira a publicação no publicador compartilhado.
+
+    Deve ser chamada de dentro do loop de eventos que mantém a conexão.
+    O Future resultante resolve para True (ack) ou False (nack).
+    """
+    return get_publisher().publish(queue, body, correlation_id)
+
+
+def flush_sync(timeout: float = 5.0):
+    """
+    Encerra o publicador compartilhado a partir de outra thread (ex.: no shutdown),
+    aguardando até timeout segundos pela entrega das mensagens pendentes.
+    """
+    publisher = _publisher
+    if publisher is None or publisher._loop is None or publisher._loop.is_closed():
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(publisher.close(), publisher._loop).result(timeout)
+    except Exception as e:
+        logger.warning("[AMQP] Não foi possível concluir as publicações pendentes no encerramento: %s", e)
@@ -34,6 +34,9 @@ class SessionData:
         self.terminate_visitor_event = asyncio.Event()
         self.terminate_resident_event = asyncio.Event()
 
+        # Sinalizado quando a sessão é removida por _complete_session_termination
+        self.termination_complete_event = asyncio.Event()
+
         self.intent_data = {}
 
         # Aqui criamos uma instância do Flow para cada sessão
@@ -156,6 +159,7 @@ class SessionManager:
         Remove efetivamente a sessão após tarefas de audiosocket terem encerrado.
         Este método deve ser chamado apenas após o encerramento completo das conexões.
         """
-        if session_id in self.sessions:
-            del self.sessions[session_id]
+        session = self.sessions.pop(session_id, None)
+        if session:
+            session.termination_complete_event.set()
             logger.info(f"[SessionManager] Sessão {session_id} finalizada e completamente removida.")
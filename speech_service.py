@@ -1,6 +1,7 @@
 import asyncio
 import os
 import hashlib
+from functools import lru_cache
 from io import BytesIO
 
 from audio_utils import converter_bytes_para_wav, converter_wav_para_slin
@@ -11,6 +12,12 @@ from pydub import AudioSegment
 CACHE_DIR = 'audio/cache'
 os.makedirs(CACHE_DIR, exist_ok=True)
 
+@lru_cache(maxsize=256)
+def _caminho_cache(texto):
+    """Caminho do áudio em cache para o texto; frases fixas repetidas não são recodificadas/hasheadas."""
+    hash_texto = hashlib.md5(texto.encode('utf-8')).hexdigest()
+    return os.path.join(CACHE_DIR, f"{hash_texto}.slin")
+
 async def transcrever_audio_async(dados_audio_slin, call_id=None):
     """
     Versão assíncrona da transcrição de áudio que aceita parâmetro de call_id
@@ -45,8 +52,7 @@ async def sintetizar_fala_async(texto, call_id=None):
     para recursos de monitoramento e gerenciamento.
     """
     # Verificar cache antes de sintetizar
-    hash_texto = hashlib.md5(texto.encode('utf-8')).hexdigest()
-    cache_path = os.path.join(CACHE_DIR, f"{hash_texto}.slin")
+    cache_path = _caminho_cache(texto)
     
     # Se já existe no cache, retornar o arquivo de áudio imediatamente
     if os.path.exists(cache_path):
@@ -253,6 +259,9 @@ def sintetizar_fala(texto):
 # Pré-carregar frases comuns
 def pre_sintetizar_frases_comuns():
     """Pré-sintetiza frases comuns para o cache."""
+    # Importado aqui: conversation_flow puxa os módulos de IA, desnecessários para quem só sintetiza
+    from conversation_flow import FINAL_MESSAGES
+    
     frases_comuns = [
         "Olá, seja bem-vindo! Em que posso ajudar?",
         "Por favor, me informe o seu nome",
@@ -260,12 +269,13 @@ def pre_sintetizar_frases_comuns():
         "Obrigado, aguarde um instante",
         "Ok, vamos entrar em contato com o morador. Aguarde, por favor.",
         "Desculpe, não consegui entender. Pode repetir por favor?",
-        "Olá, morador! Você está em ligação com a portaria inteligente."
+        "Olá, morador! Você está em ligação com a portaria inteligente.",
+        # Mensagens fixas de finalização, da mesma tabela usada por conversation_flow
+        *FINAL_MESSAGES
     ]
     
     for frase in frases_comuns:
-        hash_texto = hashlib.md5(frase.encode('utf-8')).hexdigest()
-        cache_path = os.path.join(CACHE_DIR, f"{hash_texto}.slin")
+        cache_path = _caminho_cache(frase)
         
         # Só sintetiza se não existir no cache
         if not os.path.exists(cache_path):